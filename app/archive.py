@@ -0,0 +1,83 @@
+import logging
+import os
+from datetime import date, timedelta
+from typing import Optional
+from sqlalchemy import delete, insert, select, union_all
+from sqlalchemy.orm import Session
+from . import models
+from .database import begin_immediate, retry_on_busy
+
+# Arquivamento de empréstimos: os devolvidos há mais de LOAN_ARCHIVE_AFTER_DAYS dias saem de
+# loans (camada quente, lida a cada empréstimo, devolução e listagem) e vão para loan_history
+# (camada fria) no mesmo arquivo SQLite, em lotes de LOAN_ARCHIVE_CHUNK_SIZE, cada lote em uma
+# transação curta. A tabela fica no mesmo arquivo, e não em um banco com ATTACH, porque em WAL
+# uma transação entre arquivos anexados não é atômica: um empréstimo poderia sumir das duas
+# camadas ou aparecer nas duas.
+
+LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", "365"))
+LOAN_ARCHIVE_CHUNK_SIZE = int(os.getenv("LOAN_ARCHIVE_CHUNK_SIZE", "5000"))
+
+LOAN_COLUMNS = ("id", "user_id", "book_id", "loan_date", "due_date", "return_date", "fine")
+
+logger = logging.getLogger(__name__)
+
+def columns(model):
+    return [model.__table__.c[name] for name in LOAN_COLUMNS]
+
+def all_loans(where=lambda table: []):
+    """SELECT das duas camadas (UNION ALL), com where(tabela) aplicado a cada uma."""
+    return union_all(*(
+        select(*columns(model)).where(*where(model.__table__))
+        for model in (models.Loan, models.LoanHistory)
+    ))
+
+def get_archived_loan(db: Session, loan_id: int) -> Optional[models.LoanHistory]:
+    return db.query(models.LoanHistory).filter(models.LoanHistory.id == loan_id).first()
+
+def restore_loan(db: Session, archived: models.LoanHistory) -> models.Loan:
+    # Devolve o empréstimo para loans com o mesmo id; o commit fica com quem chama
+    loan_id = archived.id
+    db.execute(insert(models.Loan).from_select(
+        LOAN_COLUMNS, select(*columns(models.LoanHistory)).where(models.LoanHistory.id == loan_id),
+    ))
+    db.execute(delete(models.LoanHistory).where(models.LoanHistory.id == loan_id))
+    db.expunge(archived)
+    logger.info("Empréstimo id=%s restaurado do histórico", loan_id)
+    return db.query(models.Loan).filter(models.Loan.id == loan_id).one()
+
+def _archive_chunk(db: Session, cutoff: date, after_id: int, chunk_size: int):
+    Loan = models.Loan
+    begin_immediate(db)
+    # loans usa AUTOINCREMENT (models.Loan): um id arquivado nunca volta a ser usado por um
+    # empréstimo novo, então qualquer empréstimo devolvido pode ir para loan_history
+    returned = [Loan.return_date != None, Loan.return_date < cutoff]
+    ids = db.execute(
+        select(Loan.id).where(*returned, Loan.id > after_id).order_by(Loan.id).limit(chunk_size)
+    ).scalars().all()
+    if not ids:
+        db.rollback()
+        return 0, after_id
+    # Faixa de ids em vez de IN (...), com limites constantes para o SQLite ler só o trecho do lote
+    in_chunk = returned + [Loan.id > after_id, Loan.id <= ids[-1]]
+    db.execute(insert(models.LoanHistory).from_select(LOAN_COLUMNS, select(*columns(Loan)).where(*in_chunk)))
+    db.execute(delete(Loan).where(*in_chunk))
+    db.commit()
+    return len(ids), ids[-1]
+
+def archive_returned_loans(
+    db: Session,
+    older_than_days: int = LOAN_ARCHIVE_AFTER_DAYS,
+    chunk_size: int = LOAN_ARCHIVE_CHUNK_SIZE,
+    today: Optional[date] = None,
+) -> int:
+    """Move para loan_history os empréstimos devolvidos antes de hoje - older_than_days."""
+    cutoff = (today or date.today()) - timedelta(days=older_than_days)
+    archived, after_id = 0, 0
+    while True:
+        moved, after_id = retry_on_busy(db, lambda: _archive_chunk(db, cutoff, after_id, chunk_size))
+        if not moved:
+            break
+        archived += moved
+        logger.info("Arquivados %s empréstimos (até o id %s)", archived, after_id)
+    logger.info("Arquivamento de empréstimos devolvidos antes de %s: %s empréstimos", cutoff, archived)
+    return archived
@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterable, Iterator, Tuple
+import anyio.from_thread
+from fastapi import HTTPException
+
+# Leitura das cargas em lote: array JSON, NDJSON (um objeto por linha) ou CSV com cabeçalho.
+# Cada item é devolvido como (número da linha, dict) para o relatório de erros por linha.
+# O corpo é lido aos pedaços, à medida que os lotes são inseridos: a memória usada depende do
+# tamanho do lote, não do tamanho da carga.
+
+# Texto lido de cada vez pelo parser do array JSON, e o maior item aceito no array
+JSON_READ_SIZE = 64 * 1024
+MAX_JSON_ITEM_SIZE = 1024 * 1024
+
+async def _next_chunk(chunks: AsyncIterator[bytes]):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+def body_chunks(stream: AsyncIterator[bytes]) -> Iterator[bytes]:
+    """Pedaços de request.stream() para código síncrono rodando em run_db.
+
+    Cada pedaço é lido no event loop (anyio.from_thread), só quando o parser precisa dele."""
+    chunks = stream.__aiter__()
+    while True:
+        chunk = anyio.from_thread.run(_next_chunk, chunks)
+        if chunk is None:
+            return
+        if chunk:
+            yield chunk
+
+class _ChunkStream(io.RawIOBase):
+    # Arquivo binário somente leitura sobre os pedaços do corpo, para TextIOWrapper e csv
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            chunk = next(self._chunks, b"")
+            if not chunk:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def _text(chunks: Iterable[bytes], encoding: str, newline=None) -> io.TextIOWrapper:
+    return io.TextIOWrapper(io.BufferedReader(_ChunkStream(chunks)), encoding=encoding, newline=newline)
+
+def _iter_json_array(chunks: Iterable[bytes]) -> Iterator[Tuple[int, object]]:
+    # Os itens do array são decodificados um a um (raw_decode) sobre um buffer que só guarda o
+    # trecho ainda não lido. Um erro de sintaxe depois do início do array encerra a leitura e
+    # vira falha do item em que ocorreu: os lotes anteriores já foram gravados.
+    text = _text(chunks, "utf-8-sig")
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        block = text.read(JSON_READ_SIZE)
+        eof = not block
+        buffer, position = buffer[position:] + block, 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if position == len(buffer):
+        raise HTTPException(status_code=400, detail="JSON inválido.")
+    if buffer[position] != "[":
+        raise HTTPException(status_code=400, detail="O corpo JSON deve ser um array de objetos.")
+    position += 1
+    skip_whitespace()
+    if buffer[position:position + 1] == "]":
+        return
+    number = 0
+    while True:
+        number += 1
+        while True:
+            try:
+                row, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                row, end = None, None
+            # Um valor que termina no fim do buffer (um número, por exemplo) pode continuar no próximo
+            # pedaço; um item inválido não é lido até o fim do corpo, só até MAX_JSON_ITEM_SIZE
+            if not eof and (end is None or end == len(buffer)) and len(buffer) - position <= MAX_JSON_ITEM_SIZE:
+                fill()
+                continue
+            break
+        if end is None:
+            yield number, None
+            return
+        position = end
+        yield number, row
+        skip_whitespace()
+        separator = buffer[position:position + 1]
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            yield number + 1, None
+            return
+        skip_whitespace()
+
+def _iter_ndjson(chunks: Iterable[bytes]) -> Iterator[Tuple[int, object]]:
+    for number, line in enumerate(_text(chunks, "utf-8"), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def _iter_csv(chunks: Iterable[bytes]) -> Iterator[Tuple[int, object]]:
+    reader = csv.DictReader(_text(chunks, "utf-8-sig", newline=""))
+    for number, row in enumerate(reader, start=1):
+        yield number, row
+
+def parse_rows(content_type: str, chunks: Iterable[bytes]) -> Iterator[Tuple[int, object]]:
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return _iter_ndjson(chunks)
+    if media_type in ("text/csv", "application/csv"):
+        return _iter_csv(chunks)
+    if media_type == "application/json":
+        return _iter_json_array(chunks)
+    raise HTTPException(status_code=415, detail=f"Formato não suportado: {media_type}. Use JSON, NDJSON ou CSV.")
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache read-through em processo para as buscas por id de services.py.
+# Guarda apenas os valores das colunas (dict), nunca instâncias ligadas a uma Session.
+
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+
+class TTLLRUCache:
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Incrementado a cada invalidação; um valor lido antes dela não é gravado depois
+        self._epoch = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = self.stale = 0
+
+    def get(self, key, version=None):
+        # version: a entrada só vale se foi gravada com a mesma versão (ver read_through)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, entry_version, value = entry
+            if expires_at < now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if entry_version != version:
+                del self._data[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def set(self, key, value, epoch: int = None, version=None):
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self).__name__,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale": self.stale,
+            }
+
+class NullCache:
+    # Desliga o cache (CACHE_MAXSIZE=0) mantendo a mesma interface
+    def get(self, key, version=None):
+        return None
+
+    def epoch(self) -> int:
+        return 0
+
+    def set(self, key, value, epoch: int = None, version=None):
+        pass
+
+    def invalidate(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+_backend = TTLLRUCache() if CACHE_MAXSIZE > 0 else NullCache()
+
+def get_backend():
+    return _backend
+
+def set_backend(backend):
+    # Permite trocar a implementação (ex.: outro processo de cache) sem mudar services.py
+    global _backend
+    _backend = backend
+
+def snapshot(instance) -> dict:
+    return {column.key: getattr(instance, column.key) for column in instance.__table__.columns}
+
+def read_through(key, loader, model, version=None):
+    # Devolve uma instância transitória (fora da Session) montada a partir do valor em cache.
+    # version é a versão da tabela (versions.table_version) lida na mesma transação do loader:
+    # uma escrita de outro worker ou de um comando de manutenção muda a versão, e a entrada
+    # antiga passa a ser um miss em vez de esperar o TTL.
+    backend = _backend
+    values = backend.get(key, version=version)
+    if values is None:
+        epoch = backend.epoch()
+        instance = loader()
+        if instance is None:
+            return None
+        values = snapshot(instance)
+        backend.set(key, values, epoch=epoch, version=version)
+    return model(**values)
+
+def invalidate(*keys):
+    _backend.invalidate(*keys)
+
+def clear():
+    _backend.clear()
+
+def stats() -> dict:
+    return _backend.stats()
@@ -0,0 +1,21 @@
+import os
+from functools import partial
+import anyio
+from anyio import CapacityLimiter
+
+# Pool limitado de threads para o trabalho síncrono com o banco (services.* + Session).
+# Os handlers async chamam run_db para não bloquear o event loop do uvicorn.
+
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+
+_limiter = None
+
+def _get_limiter() -> CapacityLimiter:
+    # O limiter precisa ser criado dentro de um event loop em execução
+    global _limiter
+    if _limiter is None:
+        _limiter = CapacityLimiter(DB_THREADS)
+    return _limiter
+
+async def run_db(func, *args, **kwargs):
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=_get_limiter())
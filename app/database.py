@@ -1,13 +1,77 @@
-from sqlalchemy import create_engine
+import logging
+import os
+import random
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./library.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./library.db")
+# Por padrão o engine de leitura aponta para o mesmo arquivo, em conexões somente leitura
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", DATABASE_URL)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Novas tentativas quando o SQLite devolve SQLITE_BUSY mesmo depois do busy_timeout
+DB_BUSY_RETRIES = int(os.getenv("DB_BUSY_RETRIES", "5"))
+DB_BUSY_BACKOFF_SECONDS = float(os.getenv("DB_BUSY_BACKOFF_SECONDS", "0.05"))
+
+logger = logging.getLogger(__name__)
+
+def _is_sqlite_file(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+def _sqlite_pragmas(read_only: bool):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if not read_only:
+                # journal_mode fica gravado no arquivo; basta a conexão de escrita defini-lo
+                cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            # Valor negativo = tamanho em KiB
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+    return set_pragmas
+
+def create_db_engine(url: str, read_only: bool = False, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    parsed = make_url(url)
+    kwargs = {}
+    if parsed.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if parsed.get_backend_name() != "sqlite" or _is_sqlite_file(parsed):
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=DB_POOL_TIMEOUT)
+    db_engine = create_engine(url, **kwargs)
+    if _is_sqlite_file(parsed):
+        event.listen(db_engine, "connect", _sqlite_pragmas(read_only))
+    return db_engine
+
+engine = create_db_engine(DATABASE_URL)
+if _is_sqlite_file(make_url(READ_DATABASE_URL)):
+    read_engine = create_db_engine(READ_DATABASE_URL, read_only=True, pool_size=DB_READ_POOL_SIZE, max_overflow=DB_READ_MAX_OVERFLOW)
+else:
+    # SQLite em memória não pode ser compartilhado entre engines
+    read_engine = engine if READ_DATABASE_URL == DATABASE_URL else create_db_engine(READ_DATABASE_URL)
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
@@ -16,4 +80,40 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    # Sessão para rotas GET: conexões somente leitura, que em WAL não esperam pelo lock de escrita
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def begin_immediate(db):
+    # Abre a transação com BEGIN IMMEDIATE: o lock de escrita é tomado antes das leituras, então
+    # o que foi lido não muda até o commit e não há upgrade de leitura para escrita (SQLITE_BUSY).
+    # Em outros bancos, ou se a transação do driver já começou, não faz nada.
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        return
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+def is_busy_error(exc: OperationalError) -> bool:
+    message = str(exc.orig).lower()
+    return "database is locked" in message or "database is busy" in message
+
+def retry_on_busy(db, operation, retries: int = DB_BUSY_RETRIES, backoff: float = DB_BUSY_BACKOFF_SECONDS):
+    """Executa operation() e, se o SQLite responder SQLITE_BUSY, desfaz e tenta de novo com
+    espera exponencial (com jitter). operation deve conter a transação inteira, até o commit."""
+    for attempt in range(retries + 1):
+        try:
+            return operation()
+        except OperationalError as exc:
+            db.rollback()
+            if attempt == retries or not is_busy_error(exc):
+                raise
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning("Banco ocupado (%s); nova tentativa %s de %s em %.0f ms", exc.orig, attempt + 1, retries, delay * 1000)
+            time.sleep(delay)
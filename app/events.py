@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+# Mudanças de disponibilidade de livros enviadas por Server-Sent Events
+# (GET /books/availability/stream). Os serviços publicam depois do commit, de qualquer thread;
+# cada inscrito tem uma fila limitada no event loop em que foi criado. A publicação só percorre
+# os interessados (índice livro -> inscritos, mais os inscritos sem filtro), e um inscrito ocioso
+# é só uma corrotina parada em queue.get(): sem thread, sem consulta, sem polling.
+# Os inscritos vivem no processo: com vários workers, cada um publica para os seus.
+
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Reconexão sugerida ao EventSource (campo retry), em ms
+SSE_RETRY_MS = 3000
+
+logger = logging.getLogger(__name__)
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class Subscriber:
+    __slots__ = ("book_ids", "queue", "loop", "overflowed")
+
+    def __init__(self, book_ids: Optional[frozenset], loop, maxsize: int):
+        self.book_ids = book_ids
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.loop = loop
+        self.overflowed = False
+
+    def offer(self, message: str) -> bool:
+        # Roda no event loop do inscrito. Com a fila cheia o cliente não está acompanhando:
+        # em vez de acumular sem limite ou segurar quem publica, ele é desconectado e o
+        # EventSource reconecta, recebendo de novo o estado atual dos livros.
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+def _deliver(broker, deliveries):
+    for subscriber, message in deliveries:
+        if subscriber.overflowed or subscriber.offer(message):
+            continue
+        broker.unsubscribe(subscriber)
+        broker.overflows += 1
+        logger.warning("Inscrito de disponibilidade desconectado: fila cheia (%s eventos)", subscriber.queue.maxsize)
+
+class AvailabilityBroker:
+    def __init__(self, queue_size: int = SSE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._everything: Set[Subscriber] = set()
+        self._by_book: Dict[int, Set[Subscriber]] = {}
+        self.published = 0
+        self.overflows = 0
+
+    def subscribe(self, book_ids: Optional[Iterable[int]] = None) -> Subscriber:
+        """Cria um inscrito no event loop atual; sem book_ids, recebe todos os livros."""
+        subscriber = Subscriber(frozenset(book_ids) if book_ids else None, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if subscriber.book_ids is None:
+                self._everything.add(subscriber)
+            else:
+                for book_id in subscriber.book_ids:
+                    self._by_book.setdefault(book_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber.book_ids is None:
+                self._everything.discard(subscriber)
+                return
+            for book_id in subscriber.book_ids:
+                subscribers = self._by_book.get(book_id)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._by_book[book_id]
+
+    def interested(self, book_ids: Iterable[int]) -> List[int]:
+        # Quem publica consulta o banco só para os livros que alguém está acompanhando
+        with self._lock:
+            if self._everything:
+                return sorted(set(book_ids))
+            return sorted(book_id for book_id in set(book_ids) if book_id in self._by_book)
+
+    def publish(self, changes: List[dict]):
+        """Envia cada mudança ({"book_id", ...}) aos interessados. Pode ser chamada de qualquer thread."""
+        deliveries = {}
+        with self._lock:
+            for change in changes:
+                message = format_event("availability", change)
+                for subscriber in (*self._everything, *self._by_book.get(change["book_id"], ())):
+                    deliveries.setdefault(subscriber.loop, []).append((subscriber, message))
+        self.published += len(changes)
+        # Uma chamada por event loop, não por inscrito: acordar o loop custa uma escrita no pipe
+        for loop, items in deliveries.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, self, items)
+            except RuntimeError:
+                # Loop já fechado (processo terminando); os inscritos dele não existem mais
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._everything) + len({s for subs in self._by_book.values() for s in subs}),
+                "unfiltered": len(self._everything),
+                "books_watched": len(self._by_book),
+                "published": self.published,
+                "overflows": self.overflows,
+            }
+
+availability = AvailabilityBroker()
+
+async def stream(subscriber: Subscriber, snapshot: List[dict], broker: AvailabilityBroker = availability, keepalive: float = SSE_KEEPALIVE_SECONDS):
+    """Corpo da resposta text/event-stream: o estado atual dos livros pedidos e depois as mudanças."""
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        for change in snapshot:
+            yield format_event("availability", change)
+        # O gerador vive enquanto a conexão estiver aberta: o estado inicial não fica preso a ele
+        del snapshot
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                # Comentário SSE: mantém a conexão viva atrás de proxies sem gerar evento no cliente
+                yield ": keepalive\n\n"
+                continue
+            if subscriber.overflowed:
+                yield format_event("overflow", {"queue_size": subscriber.queue.maxsize})
+                return
+            yield message
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,91 @@
+import csv
+import datetime
+import io
+import json
+from typing import Iterator, Optional
+from fastapi import HTTPException
+from sqlalchemy import select
+from . import archive, models
+from .database import read_engine
+
+# Exportação em streaming: as linhas saem de um cursor do servidor (stream_results)
+# em blocos de EXPORT_BATCH_SIZE, sem materializar objetos ORM nem modelos Pydantic.
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+def media_type_for(fmt: str) -> str:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato de exportação inválido. Use ndjson ou csv.")
+    return EXPORT_FORMATS[fmt]
+
+def users_statement():
+    table = models.User.__table__
+    return select(table.c.id, table.c.name, table.c.email).order_by(table.c.id)
+
+def books_statement():
+    table = models.Book.__table__
+    return select(table.c.id, table.c.title, table.c.author, table.c.quantity).order_by(table.c.id)
+
+def loans_statement(
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    status: Optional[str] = None,
+):
+    if status not in (None, "active", "returned"):
+        raise HTTPException(status_code=400, detail="Status inválido. Use active ou returned.")
+
+    def where(table):
+        conditions = []
+        if start_date:
+            conditions.append(table.c.loan_date >= start_date)
+        if end_date:
+            conditions.append(table.c.loan_date <= end_date)
+        if status == "active":
+            conditions.append(table.c.return_date == None)
+        elif status == "returned":
+            conditions.append(table.c.return_date != None)
+        return conditions
+
+    if status == "active":
+        # loan_history só guarda empréstimos devolvidos
+        table = models.Loan.__table__
+        return select(*archive.columns(models.Loan)).where(*where(table)).order_by(table.c.loan_date, table.c.id)
+    # As duas camadas, cada uma lida em ordem pelo índice (loan_date, id) e intercaladas pelo
+    # SQLite (MERGE), sem ordenar o resultado inteiro
+    statement = archive.all_loans(where)
+    return statement.order_by(statement.selected_columns.loan_date, statement.selected_columns.id)
+
+def _json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(value)}")
+
+def _encode_ndjson(columns, batch) -> str:
+    return "".join(json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n" for row in batch)
+
+def _encode_csv(writer, buffer, batch) -> str:
+    writer.writerows(batch)
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+def stream_rows(statement, fmt: str, bind=read_engine) -> Iterator[str]:
+    # A conexão é aberta aqui, e não via get_db, porque o corpo é enviado depois que a rota retorna
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(statement)
+        columns = list(result.keys())
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield _encode_csv(writer, buffer, [])
+            for batch in result.partitions():
+                yield _encode_csv(writer, buffer, batch)
+        else:
+            for batch in result.partitions():
+                yield _encode_ndjson(columns, batch)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from . import archive, logs, migrations, services
+from .concurrency import run_db
+from .database import SessionLocal, engine
+
+# Inicialização das aplicações (logging e schema) e tarefas periódicas executadas dentro do
+# processo. Nada disso roda na importação: importar app.run_api_only ou app.run_frontend
+# (testes, ferramentas, workers) não abre o banco nem configura o logging.
+# As tarefas periódicas ficam desligadas por padrão: com vários workers, basta habilitar em
+# um deles (ou usar o cron + CLI).
+
+FINE_JOB_INTERVAL_SECONDS = float(os.getenv("FINE_JOB_INTERVAL_SECONDS", "0"))
+LOAN_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("LOAN_ARCHIVE_INTERVAL_SECONDS", "0"))
+# Com 0, a aplicação não cria nem migra o schema: só confere a versão e recusa subir se o
+# banco estiver desatualizado (o upgrade fica para python -m app.maintenance upgrade)
+SCHEMA_AUTO_UPGRADE = os.getenv("SCHEMA_AUTO_UPGRADE", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+def run_fine_job() -> int:
+    db = SessionLocal()
+    try:
+        return services.accrue_overdue_fines(db)
+    finally:
+        db.close()
+
+def run_archive_job() -> int:
+    db = SessionLocal()
+    try:
+        return archive.archive_returned_loans(db)
+    finally:
+        db.close()
+
+async def _run_periodically(interval: float, job):
+    while True:
+        try:
+            await run_db(job)
+        except Exception:
+            logger.exception("Falha na tarefa periódica %s", job.__name__)
+        await asyncio.sleep(interval)
+
+def prepare_schema() -> int:
+    # Com o schema já na versão atual, os dois caminhos custam um PRAGMA user_version
+    if SCHEMA_AUTO_UPGRADE:
+        return migrations.upgrade(engine)
+    return migrations.require_current(engine)
+
+@asynccontextmanager
+async def lifespan(app):
+    logs.configure_logging()
+    await run_db(prepare_schema)
+    tasks = []
+    if FINE_JOB_INTERVAL_SECONDS > 0:
+        logger.info("Cálculo de multas agendado a cada %ss", FINE_JOB_INTERVAL_SECONDS)
+        tasks.append(asyncio.create_task(_run_periodically(FINE_JOB_INTERVAL_SECONDS, run_fine_job)))
+    if LOAN_ARCHIVE_INTERVAL_SECONDS > 0:
+        logger.info("Arquivamento de empréstimos agendado a cada %ss", LOAN_ARCHIVE_INTERVAL_SECONDS)
+        tasks.append(asyncio.create_task(_run_periodically(LOAN_ARCHIVE_INTERVAL_SECONDS, run_archive_job)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
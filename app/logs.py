@@ -0,0 +1,156 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+
+# Configuração de logging da aplicação, chamada uma vez na inicialização de cada app.
+# Os registros vão para uma fila e são formatados e escritos por uma thread separada
+# (QueueListener), então o handler da requisição não espera pela escrita em stderr.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text ou json
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Amostragem por logger, ex.: "app.services.reads=0.1,frontend=0.5". Avisos e erros nunca são descartados.
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s"
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_listener = None
+_sampled_loggers = []
+
+def parse_sample_rates(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Com a fila cheia o registro é descartado em vez de bloquear a requisição
+    dropped = 0
+
+    def prepare(self, record):
+        # A mensagem é montada na thread de escrita (msg % args); aqui só se copia o que
+        # depende da thread atual: o request id (já no registro) e o traceback
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+def configure_logging(level: str = None, fmt: str = None, use_queue: bool = None, sample: str = None, stream=None):
+    """Configura o logger raiz. Pode ser chamada de novo para trocar a configuração."""
+    global _listener
+    level = level or LOG_LEVEL
+    fmt = fmt or LOG_FORMAT
+    use_queue = LOG_ASYNC if use_queue is None else use_queue
+    sample = LOG_SAMPLE if sample is None else sample
+
+    shutdown()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for logger in _sampled_loggers:
+        for log_filter in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(log_filter)
+    _sampled_loggers.clear()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    if use_queue:
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    # O filtro roda na thread da requisição, onde o contextvar ainda tem o request id
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    for name, rate in parse_sample_rates(sample).items():
+        if rate < 1.0:
+            logger = logging.getLogger(name)
+            logger.addFilter(SamplingFilter(rate))
+            _sampled_loggers.append(logger)
+
+def shutdown():
+    # Esvazia a fila antes de sair do processo
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown)
+
+class RequestIdMiddleware:
+    """Middleware ASGI: usa o X-Request-ID recebido (ou gera um) e o devolve na resposta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
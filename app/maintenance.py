@@ -0,0 +1,125 @@
+import argparse
+import logging
+import sys
+from datetime import date
+from sqlalchemy import func, literal, select, text, tuple_, update
+from sqlalchemy.orm import Session
+from . import archive, cache, logs, migrations, models, services, stats
+from .database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+def rebuild_active_loan_counters(db: Session):
+    logger.info("Reconstruindo contadores de empréstimos ativos a partir da tabela loans")
+    open_loans = select(func.count(models.Loan.id)).where(models.Loan.return_date == None)
+    db.execute(
+        update(models.Book).values(
+            active_loans=open_loans.where(models.Loan.book_id == models.Book.id).scalar_subquery()
+        )
+    )
+    db.execute(
+        update(models.User).values(
+            active_loans=open_loans.where(models.Loan.user_id == models.User.id).scalar_subquery()
+        )
+    )
+    db.commit()
+    cache.clear()
+    logger.info("Contadores de empréstimos ativos reconstruídos")
+
+def rebuild_search_index(db: Session):
+    logger.info("Reconstruindo o índice de busca books_fts")
+    db.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+    db.commit()
+
+def hot_loan_queries():
+    # Espelham as consultas de services.py que tocam a tabela loans
+    Loan = models.Loan
+    return {
+        "get_loans": select(Loan).order_by(Loan.loan_date.desc(), Loan.id.desc()).limit(100),
+        "get_loans_after": select(Loan)
+            .where(tuple_(Loan.loan_date, Loan.id) < tuple_(literal(date(2024, 1, 1)), literal(1)))
+            .order_by(Loan.loan_date.desc(), Loan.id.desc()).limit(100),
+        "get_user_loans": select(Loan).where(Loan.user_id == 1),
+        "get_user_loans_history": select(models.LoanHistory).where(models.LoanHistory.user_id == 1),
+        "return_loan": select(Loan).where(Loan.id == 1, Loan.return_date == None),
+        "open_loans_by_book": select(func.count(Loan.id)).where(Loan.book_id == 1, Loan.return_date == None),
+        "open_loans_by_user": select(func.count(Loan.id)).where(Loan.user_id == 1, Loan.return_date == None),
+        "overdue_loans": select(Loan).where(Loan.return_date == None, Loan.due_date < literal(date(2024, 1, 1)))
+            .order_by(Loan.due_date, Loan.id).limit(100),
+    }
+
+def explain_hot_queries(bind):
+    plans = {}
+    with bind.connect() as conn:
+        for name, statement in hot_loan_queries().items():
+            sql = str(statement.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+def _uses_index(plan):
+    loan_steps = [step for step in plan if " loans" in step or " loan_history" in step]
+    return bool(loan_steps) and all(
+        "USING INDEX" in step or "USING COVERING INDEX" in step or "USING INTEGER PRIMARY KEY" in step
+        for step in loan_steps
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tarefas de manutenção da Biblioteca Digital")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("upgrade", help="Cria ou atualiza o schema do banco para a versão atual")
+    subparsers.add_parser("rebuild-counters", help="Recalcula users.active_loans e books.active_loans")
+    subparsers.add_parser("rebuild-search", help="Reconstrói o índice de busca textual de livros (books_fts)")
+    subparsers.add_parser("rebuild-stats", help="Recalcula as tabelas de estatísticas de circulação a partir de loans")
+    accrue = subparsers.add_parser("accrue-fines", help="Atualiza a multa acumulada dos empréstimos abertos e atrasados")
+    accrue.add_argument("--as-of", type=date.fromisoformat, default=None, help="Data de referência (AAAA-MM-DD); padrão: hoje")
+    accrue.add_argument("--chunk-size", type=int, default=services.FINE_JOB_CHUNK_SIZE, help="Empréstimos por UPDATE; 0 faz tudo em um só")
+    archive_parser = subparsers.add_parser("archive-loans", help="Move para loan_history os empréstimos devolvidos há mais de N dias")
+    archive_parser.add_argument("--older-than-days", type=int, default=archive.LOAN_ARCHIVE_AFTER_DAYS, help="Idade mínima da devolução, em dias")
+    archive_parser.add_argument("--chunk-size", type=int, default=archive.LOAN_ARCHIVE_CHUNK_SIZE, help="Empréstimos movidos por transação")
+    subparsers.add_parser("explain", help="Mostra o EXPLAIN QUERY PLAN das consultas de empréstimos e falha se alguma não usar índice")
+    args = parser.parse_args(argv)
+
+    logs.configure_logging(use_queue=False)
+    migrations.upgrade(engine)
+    if args.command == "rebuild-counters":
+        db = SessionLocal()
+        try:
+            rebuild_active_loan_counters(db)
+        finally:
+            db.close()
+    elif args.command == "rebuild-search":
+        db = SessionLocal()
+        try:
+            rebuild_search_index(db)
+        finally:
+            db.close()
+    elif args.command == "rebuild-stats":
+        db = SessionLocal()
+        try:
+            stats.rebuild(db)
+        finally:
+            db.close()
+    elif args.command == "accrue-fines":
+        db = SessionLocal()
+        try:
+            services.accrue_overdue_fines(db, as_of=args.as_of, chunk_size=args.chunk_size)
+        finally:
+            db.close()
+    elif args.command == "archive-loans":
+        db = SessionLocal()
+        try:
+            archive.archive_returned_loans(db, older_than_days=args.older_than_days, chunk_size=args.chunk_size)
+        finally:
+            db.close()
+    elif args.command == "explain":
+        ok = True
+        for name, plan in explain_hot_queries(engine).items():
+            uses_index = _uses_index(plan)
+            ok = ok and uses_index
+            print(f"{'OK ' if uses_index else 'SCAN'} {name}: {' | '.join(plan)}")
+        if not ok:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
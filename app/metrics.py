@@ -0,0 +1,199 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Métricas por rota no formato texto do Prometheus (GET /metrics), com contagem e tempo
+# de SQL por requisição (eventos do SQLAlchemy) e tempo de renderização dos templates.
+# Os valores vivem no processo: com vários workers, cada um expõe os seus.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Cabeçalho Server-Timing com app, db e render; desligado por padrão porque expõe tempos internos
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_STATEMENTS = 5
+# Limite de instruções guardadas por requisição para o log de lentidão
+MAX_RECORDED_STATEMENTS = 200
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+logger = logging.getLogger(__name__)
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds", "render_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statements = []
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.db_queries = {}
+        self.db_seconds = {}
+        self.render = {}
+
+    def record_request(self, method: str, route: str, status: int, seconds: Optional[float], stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            if seconds is None:
+                return
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.db_queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+            self.db_seconds.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(stats.sql_seconds)
+
+    def record_render(self, template: str, seconds: float):
+        with self._lock:
+            self.render.setdefault(template, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            for series in (self.requests, self.latency, self.db_queries, self.db_seconds, self.render):
+                series.clear()
+
+    def render_text(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append("# HELP http_requests_total Requisições atendidas por rota e status.")
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+            for name, help_text, series in (
+                ("http_request_duration_seconds", "Latência das requisições.", self.latency),
+                ("http_request_db_queries", "Consultas SQL por requisição.", self.db_queries),
+                ("http_request_db_seconds", "Tempo de SQL por requisição.", self.db_seconds),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (method, route), histogram in sorted(series.items()):
+                    lines.extend(histogram.lines(name, f'method="{method}",route="{route}"'))
+            lines.append("# HELP template_render_seconds Tempo de renderização dos templates Jinja2.")
+            lines.append("# TYPE template_render_seconds histogram")
+            for template, histogram in sorted(self.render.items()):
+                lines.extend(histogram.lines("template_render_seconds", f'template="{template}"'))
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None or not conn.info.get("metrics_query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    if len(stats.statements) < MAX_RECORDED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+def observe_render(template: str, seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.render_seconds += seconds
+    if METRICS_ENABLED:
+        registry.record_render(template, seconds)
+
+def _server_timing(total: float, stats: RequestStats) -> str:
+    return (
+        f"app;dur={total * 1000:.1f}, db;dur={stats.sql_seconds * 1000:.1f};desc=\"{stats.queries} queries\", "
+        f"render;dur={stats.render_seconds * 1000:.1f}"
+    )
+
+def _log_slow_request(method: str, path: str, route: str, seconds: float, stats: RequestStats):
+    slowest = sorted(stats.statements, key=lambda item: item[0], reverse=True)[:SLOW_REQUEST_STATEMENTS]
+    logger.warning(
+        "Requisição lenta: %s %s (rota %s) em %.1f ms; %s consultas, %.1f ms de SQL, %.1f ms de render%s",
+        method, path, route, seconds * 1000, stats.queries, stats.sql_seconds * 1000, stats.render_seconds * 1000,
+        "".join(f"\n  {elapsed * 1000:.1f} ms: {' '.join(statement.split())}" for elapsed, statement in slowest),
+    )
+
+class MetricsMiddleware:
+    """Middleware ASGI: mede cada requisição HTTP e alimenta o registry e o log de lentidão."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_with_timing(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+                if SERVER_TIMING:
+                    header = _server_timing(time.perf_counter() - start, stats).encode("latin-1")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - start
+            # scope["route"] é preenchido pelo roteamento do FastAPI; agrupa por caminho com parâmetros
+            route = getattr(scope.get("route"), "path", "unmatched")
+            # Server-Sent Events ficam abertos enquanto o cliente quiser: a duração não é
+            # latência, então só a contagem entra nas métricas e não há log de lentidão
+            registry.record_request(scope["method"], route, status, None if streaming else elapsed, stats)
+            if not streaming and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(scope["method"], scope["path"], route, elapsed, stats)
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(registry.render_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,160 @@
+import logging
+from sqlalchemy import inspect, text
+from . import models, stats
+
+logger = logging.getLogger(__name__)
+
+# Versão do schema gravada em PRAGMA user_version do SQLite
+SCHEMA_VERSION = 11
+
+def _add_active_loan_counters(conn):
+    for table in ("users", "books"):
+        columns = {column["name"] for column in inspect(conn).get_columns(table)}
+        if "active_loans" not in columns:
+            logger.info("Adicionando coluna active_loans em %s", table)
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN active_loans INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text(
+        "UPDATE books SET active_loans = "
+        "(SELECT COUNT(*) FROM loans WHERE loans.book_id = books.id AND loans.return_date IS NULL)"
+    ))
+    conn.execute(text(
+        "UPDATE users SET active_loans = "
+        "(SELECT COUNT(*) FROM loans WHERE loans.user_id = users.id AND loans.return_date IS NULL)"
+    ))
+
+def _add_loan_indexes(conn):
+    for index in models.Loan.__table__.indexes:
+        logger.info("Criando índice %s", index.name)
+        index.create(bind=conn, checkfirst=True)
+
+def _add_books_fts(conn):
+    logger.info("Criando índice de busca textual books_fts")
+    models.create_books_fts(conn)
+    conn.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+
+def _add_overdue_index(conn):
+    index = next(index for index in models.Loan.__table__.indexes if index.name == "ix_loans_open_due_date")
+    logger.info("Criando índice %s", index.name)
+    index.create(bind=conn, checkfirst=True)
+
+def _add_circulation_stats(conn):
+    # As tabelas já foram criadas por create_all; aqui só são preenchidas
+    logger.info("Calculando as estatísticas de circulação")
+    stats.rebuild_tables(conn)
+
+def _add_suggest_indexes(conn):
+    # Os índices de lower(coluna) desta versão foram trocados pelos das chaves de busca (versão 10)
+    logger.info("Índices de sugestão criados na migração 10")
+
+def _add_loan_history(conn):
+    # A tabela e os índices já foram criados por create_all; o arquivamento fica com
+    # python -m app.maintenance archive-loans ou com a tarefa periódica
+    logger.info("Tabela loan_history criada para o arquivamento de empréstimos")
+
+def _add_table_versions(conn):
+    # Tabela e triggers já foram criados por create_all (after_create do metadata)
+    logger.info("Versões das tabelas passam a ser mantidas no banco (table_versions)")
+
+def _add_loans_autoincrement(conn):
+    # O SQLite não altera a chave de uma tabela: loans é recriada com AUTOINCREMENT. Os índices
+    # antigos saem antes (os nomes se repetem na tabela nova) e os triggers somem com a tabela antiga
+    logger.info("Recriando loans com AUTOINCREMENT")
+    loans = models.Loan.__table__
+    for index in loans.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    conn.execute(text("ALTER TABLE loans RENAME TO loans_old"))
+    loans.create(bind=conn)
+    columns = ", ".join(column.name for column in loans.columns)
+    conn.execute(text(f"INSERT INTO loans ({columns}) SELECT {columns} FROM loans_old"))
+    conn.execute(text("DROP TABLE loans_old"))
+    models.create_table_versions(conn)
+    # Os próximos ids começam depois de todos os já usados, inclusive os arquivados
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'loans'"))
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'loans', "
+        "max(coalesce((SELECT max(id) FROM loans), 0), coalesce((SELECT max(id) FROM loan_history), 0))"
+    ))
+    duplicated = conn.execute(text("SELECT COUNT(*) FROM loans JOIN loan_history USING (id)")).scalar()
+    if duplicated:
+        logger.warning(
+            "%s ids de empréstimo já existem em loans e em loan_history (ids reaproveitados antes "
+            "desta migração); esses empréstimos precisam ser conferidos manualmente", duplicated,
+        )
+
+def _add_search_keys(conn):
+    # O lower() do SQLite não remove acentos nem trata maiúsculas acentuadas ("Érica"): as
+    # sugestões passam a usar colunas com models.search_key, preenchidas aqui em blocos por id
+    for table, keys in models.SEARCH_KEYS.items():
+        columns = {column["name"] for column in inspect(conn).get_columns(table)}
+        for key in keys:
+            if key not in columns:
+                logger.info("Adicionando coluna %s em %s", key, table)
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {key} VARCHAR"))
+        sources = list(dict.fromkeys(keys.values()))
+        select_sql = text(f"SELECT id, {', '.join(sources)} FROM {table} WHERE id > :after ORDER BY id LIMIT 10000")
+        update_sql = text(f"UPDATE {table} SET {', '.join(f'{key} = :{key}' for key in keys)} WHERE id = :id")
+        after = 0
+        while True:
+            rows = conn.execute(select_sql, {"after": after}).mappings().all()
+            if not rows:
+                break
+            conn.execute(update_sql, [models.with_search_keys(table, dict(row)) for row in rows])
+            after = rows[-1]["id"]
+    for name in ("ix_users_name_lower", "ix_users_email_lower", "ix_books_title_lower"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for table in (models.User.__table__, models.Book.__table__):
+        for index in table.indexes:
+            if index.name.endswith("_key"):
+                logger.info("Criando índice %s", index.name)
+                index.create(bind=conn, checkfirst=True)
+
+def _defer_books_fts_in_bulk(conn):
+    # O trigger de inserção passa a ter a condição WHEN de books_fts_deferred
+    logger.info("Recriando o trigger books_fts_ai")
+    conn.execute(text("DROP TRIGGER IF EXISTS books_fts_ai"))
+    models.create_books_fts(conn)
+
+# Cada passo leva o schema da versão N-1 para a versão N
+MIGRATIONS = {
+    1: _add_active_loan_counters,
+    2: _add_loan_indexes,
+    3: _add_books_fts,
+    4: _add_overdue_index,
+    5: _add_circulation_stats,
+    6: _add_suggest_indexes,
+    7: _add_loan_history,
+    8: _add_table_versions,
+    9: _add_loans_autoincrement,
+    10: _add_search_keys,
+    11: _defer_books_fts_in_bulk,
+}
+
+def get_schema_version(conn) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def require_current(engine) -> int:
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+    if current < SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Schema do banco na versão {current}, a aplicação espera a {SCHEMA_VERSION}: "
+            "execute python -m app.maintenance upgrade"
+        )
+    return current
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        current = get_schema_version(conn)
+        if current >= SCHEMA_VERSION:
+            return current
+        # Banco novo: create_all já cria tabelas, colunas e índices da versão atual
+        existing = inspect(conn).has_table("loans")
+        models.Base.metadata.create_all(bind=conn)
+        if existing:
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                logger.info("Aplicando migração de schema %s", version)
+                MIGRATIONS[version](conn)
+        else:
+            logger.info("Schema criado na versão %s", SCHEMA_VERSION)
+        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    return SCHEMA_VERSION
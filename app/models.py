@@ -1,25 +1,69 @@
-from sqlalchemy import Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Date, Float, ForeignKey, Index, case, event, text
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, validates
 from .database import Base
 import datetime
+import unicodedata
+
+def search_key(value):
+    # Chave das sugestões por prefixo: sem acentos e com casefold. O lower() do SQLite só trata
+    # ASCII, então a chave é calculada aqui, tanto para gravar quanto para o texto buscado.
+    if value is None:
+        return None
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+# Colunas de chave de busca e a coluna de onde cada uma vem, para as inserções em lote
+SEARCH_KEYS = {"users": {"name_key": "name", "email_key": "email"}, "books": {"title_key": "title"}}
+
+def with_search_keys(table: str, values: dict) -> dict:
+    return {**values, **{key: search_key(values[source]) for key, source in SEARCH_KEYS.get(table, {}).items()}}
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
+    # Contador desnormalizado de empréstimos em aberto (return_date IS NULL)
+    active_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    # Sugestões por prefixo (GET /users/suggest): search_key de name e email, já na ordem do índice
+    name_key = Column(String, index=True)
+    email_key = Column(String, index=True)
 
     loans = relationship("Loan", back_populates="user")
 
+    @validates("name", "email")
+    def _fill_search_key(self, key, value):
+        setattr(self, f"{key}_key", search_key(value))
+        return value
+
 class Book(Base):
     __tablename__ = "books"
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     author = Column(String, index=True)
     quantity = Column(Integer, default=1)
+    # Contador desnormalizado de empréstimos em aberto (return_date IS NULL)
+    active_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    # Sugestões por prefixo do título (GET /books/suggest)
+    title_key = Column(String, index=True)
 
     loans = relationship("Loan", back_populates="book")
 
+    @validates("title")
+    def _fill_search_key(self, key, value):
+        self.title_key = search_key(value)
+        return value
+
+    @hybrid_property
+    def available_copies(self):
+        # Derivado do contador: na listagem é uma expressão da própria linha, sem agregar loans
+        return max(self.quantity - self.active_loans, 0)
+
+    @available_copies.expression
+    def available_copies(cls):
+        return case((cls.quantity > cls.active_loans, cls.quantity - cls.active_loans), else_=0)
+
 class Loan(Base):
     __tablename__ = "loans"
     id = Column(Integer, primary_key=True, index=True)
@@ -31,4 +75,140 @@ class Loan(Base):
     fine = Column(Float, default=0.0)
 
     user = relationship("User", back_populates="loans")
-    book = relationship("Book", back_populates="loans")
\ No newline at end of file
+    book = relationship("Book", back_populates="loans")
+
+    __table_args__ = (
+        # Empréstimos em aberto por livro/usuário (disponibilidade, limite, exclusões)
+        Index("ix_loans_book_open", "book_id", sqlite_where=text("return_date IS NULL")),
+        Index("ix_loans_user_open", "user_id", sqlite_where=text("return_date IS NULL")),
+        # Empréstimos em aberto por vencimento (atrasados e cálculo de multas)
+        Index("ix_loans_open_due_date", "due_date", "id", sqlite_where=text("return_date IS NULL")),
+        # Histórico por usuário e listagem geral ordenada por data
+        Index("ix_loans_user_loan_date", "user_id", "loan_date"),
+        Index("ix_loans_book_loan_date", "book_id", "loan_date"),
+        Index("ix_loans_loan_date_id", "loan_date", "id"),
+        # AUTOINCREMENT: ids de empréstimos removidos ou arquivados em loan_history nunca são
+        # reaproveitados, então o mesmo id não existe nas duas camadas
+        {"sqlite_autoincrement": True},
+    )
+
+# Camada fria do histórico: empréstimos devolvidos há mais de LOAN_ARCHIVE_AFTER_DAYS dias,
+# movidos de loans por archive.py com o mesmo id. Só guarda empréstimos devolvidos, então as
+# consultas de empréstimos em aberto nunca precisam olhar para cá.
+class LoanHistory(Base):
+    __tablename__ = "loan_history"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    book_id = Column(Integer, ForeignKey("books.id"))
+    loan_date = Column(Date)
+    due_date = Column(Date)
+    return_date = Column(Date)
+    fine = Column(Float, default=0.0)
+
+    user = relationship("User", viewonly=True)
+    book = relationship("Book", viewonly=True)
+
+    __table_args__ = (
+        Index("ix_loan_history_user_loan_date", "user_id", "loan_date"),
+        Index("ix_loan_history_loan_date_id", "loan_date", "id"),
+    )
+
+# Tabelas de resumo da circulação, atualizadas na mesma transação de cada empréstimo,
+# devolução e remoção (ver stats.py). O painel lê só estas tabelas, nunca varre loans.
+class CirculationTotals(Base):
+    __tablename__ = "circulation_totals"
+    # Linha única (id = 1), inserida na criação da tabela
+    id = Column(Integer, primary_key=True)
+    total_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    active_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    returned_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    users_with_active_loans = Column(Integer, nullable=False, default=0, server_default="0")
+    total_fines = Column(Float, nullable=False, default=0.0, server_default="0")
+
+class BookCirculation(Base):
+    __tablename__ = "book_circulation"
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    total_loans = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # Livros mais emprestados: os primeiros N saem direto do índice
+        Index("ix_book_circulation_total_loans", "total_loans"),
+    )
+
+class DailyCheckouts(Base):
+    __tablename__ = "daily_checkouts"
+    day = Column(Date, primary_key=True)
+    checkouts = Column(Integer, nullable=False, default=0, server_default="0")
+
+@event.listens_for(CirculationTotals.__table__, "after_create")
+def _insert_circulation_totals_row(target, connection, **kw):
+    connection.execute(target.insert().values(id=1))
+
+# Índice de busca textual (FTS5) sobre título e autor, sincronizado com books por triggers.
+# remove_diacritics 2 faz "memorias" casar com "Memórias"; prefix acelera buscas por prefixo.
+# Nas cargas em lote, uma linha em books_fts_deferred suspende o trigger de inserção dentro da
+# transação do lote, que indexa as linhas novas de uma vez (BOOKS_FTS_SYNC_SQL).
+BOOKS_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5'
+    )""",
+    "CREATE TABLE IF NOT EXISTS books_fts_deferred (active INTEGER)",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books
+        WHEN NOT EXISTS (SELECT 1 FROM books_fts_deferred) BEGIN
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+]
+
+BOOKS_FTS_SYNC_SQL = "INSERT INTO books_fts(rowid, title, author) SELECT id, title, author FROM books WHERE id > ?"
+
+def create_books_fts(connection):
+    for statement in BOOKS_FTS_DDL:
+        connection.exec_driver_sql(statement)
+
+@event.listens_for(Book.__table__, "after_create")
+def _create_books_fts(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        create_books_fts(connection)
+
+# Versões das tabelas lidas pelas rotas GET (ETag/Last-Modified, app/versions.py). Ficam no
+# banco, e não no processo, para valer entre workers e para escritas feitas fora da API
+# (manutenção, cron). Triggers incrementam a versão na mesma transação da escrita.
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    # Segundos Unix, com fração, da última escrita
+    modified_at = Column(Float, nullable=False)
+
+# Tabela gravada -> versão incrementada; o arquivo de empréstimos conta como loans
+VERSIONED_TABLES = {"users": "users", "books": "books", "loans": "loans", "loan_history": "loans"}
+_NOW_UNIX = "(julianday('now') - 2440587.5) * 86400.0"
+
+def create_table_versions(connection):
+    # Versão inicial aleatória: um banco recriado não repete ETags de um banco anterior
+    for name in sorted(set(VERSIONED_TABLES.values())):
+        connection.exec_driver_sql(
+            f"INSERT OR IGNORE INTO table_versions (name, version, modified_at) "
+            f"VALUES ('{name}', abs(random() % 1000000000), {_NOW_UNIX})"
+        )
+    for table, name in VERSIONED_TABLES.items():
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_version_{operation.lower()} AFTER {operation} ON {table} BEGIN "
+                f"UPDATE table_versions SET version = version + 1, modified_at = {_NOW_UNIX} WHERE name = '{name}'; "
+                "END"
+            )
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_table_versions(target, connection, **kw):
+    # No metadata, e não na tabela, porque os triggers precisam de todas as tabelas versionadas
+    if connection.dialect.name == "sqlite":
+        create_table_versions(connection)
@@ -0,0 +1,59 @@
+import base64
+import datetime
+import json
+from fastapi import HTTPException
+
+# Cursores opacos para paginação por chave (keyset): codificam a chave de ordenação
+# da última linha da página em base64 url-safe.
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime.date) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    return payload
+
+def decode_id_cursor(cursor: str) -> int:
+    payload = _decode(cursor)
+    if len(payload) != 1 or not isinstance(payload[0], int):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    return payload[0]
+
+def decode_loan_cursor(cursor: str) -> tuple:
+    payload = _decode(cursor)
+    try:
+        loan_date, loan_id = payload
+        return datetime.date.fromisoformat(loan_date), int(loan_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+def _last(rows, *names):
+    # Linhas podem ser instâncias do ORM (frontend) ou dicts (caminho rápido da API)
+    row = rows[-1]
+    if isinstance(row, dict):
+        return [row[name] for name in names]
+    return [getattr(row, name) for name in names]
+
+def next_id_cursor(rows, limit: int):
+    if limit and len(rows) == limit:
+        return encode_cursor(*_last(rows, "id"))
+    return None
+
+def next_loan_cursor(rows, limit: int):
+    if limit and len(rows) == limit:
+        return encode_cursor(*_last(rows, "loan_date", "id"))
+    return None
+
+def next_overdue_cursor(rows, limit: int):
+    # Atrasados são ordenados por (due_date, id); o cursor é decodificado por decode_loan_cursor
+    if limit and len(rows) == limit:
+        return encode_cursor(*_last(rows, "due_date", "id"))
+    return None
@@ -0,0 +1,99 @@
+import os
+import time
+from starlette.responses import StreamingResponse
+from . import cache, metrics, models
+
+# Renderização dos templates do frontend: cache de bytecode em disco (os templates não são
+# recompilados a cada início de processo), cache das linhas de tabela já renderizadas e
+# resposta em streaming para as listagens, que começam a sair antes de a tabela terminar.
+
+TEMPLATE_BYTECODE_CACHE = os.getenv("TEMPLATE_BYTECODE_CACHE", "1") == "1"
+# Sem diretório definido, o Jinja usa um diretório por usuário dentro do tmp do sistema
+TEMPLATE_BYTECODE_CACHE_DIR = os.getenv("TEMPLATE_BYTECODE_CACHE_DIR") or None
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "20000"))
+# A chave já muda junto com a linha; o TTL só devolve memória de linhas que não aparecem mais
+FRAGMENT_CACHE_TTL_SECONDS = float(os.getenv("FRAGMENT_CACHE_TTL_SECONDS", "3600"))
+# Pedaços menores que isso são acumulados antes de enviar, para não gerar um envio por tag
+STREAM_CHUNK_SIZE = 8192
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(PROJECT_DIR, "templates")
+STATIC_DIR = os.path.join(PROJECT_DIR, "static")
+
+fragments = cache.TTLLRUCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL_SECONDS) if FRAGMENT_CACHE_SIZE > 0 else cache.NullCache()
+
+def row_version(row) -> tuple:
+    # Versão da linha: todos os valores que o fragmento pode exibir. Qualquer alteração gera
+    # outra chave, então o cache nunca precisa ser invalidado pela camada de serviço.
+    version = tuple(getattr(row, column.key) for column in row.__table__.columns)
+    if isinstance(row, models.Loan):
+        # Empréstimos devolvidos podem apontar para um usuário ou livro já removido: a célula sai vazia
+        version += (getattr(row.user, "name", None), getattr(row.book, "title", None))
+    return version
+
+def configure(templates):
+    from jinja2 import FileSystemBytecodeCache
+    from markupsafe import Markup
+
+    env = templates.env
+    if TEMPLATE_BYTECODE_CACHE:
+        env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_BYTECODE_CACHE_DIR)
+
+    def cached_row(name: str, row):
+        key = (name, row_version(row))
+        html = fragments.get(key)
+        if html is None:
+            html = env.get_template(name).render(row=row)
+            fragments.set(key, html)
+        return Markup(html)
+
+    env.globals["cached_row"] = cached_row
+    return templates
+
+def create_templates():
+    """Jinja2Templates do frontend, configurado e medindo o tempo de cada TemplateResponse.
+
+    O Jinja2 só é importado aqui, e não na importação do app."""
+    from fastapi.templating import Jinja2Templates
+
+    class InstrumentedTemplates(Jinja2Templates):
+        def TemplateResponse(self, *args, **kwargs):
+            start = time.perf_counter()
+            response = super().TemplateResponse(*args, **kwargs)
+            metrics.observe_render(response.template.name, time.perf_counter() - start)
+            return response
+
+    return configure(InstrumentedTemplates(directory=TEMPLATES_DIR))
+
+_templates = None
+
+def get_templates():
+    # Criados na primeira página renderizada; os processos que não renderizam nada não pagam a carga
+    global _templates
+    if _templates is None:
+        _templates = create_templates()
+    return _templates
+
+def _chunks(template, context):
+    buffer = []
+    size = 0
+    rendering = 0.0
+    start = time.perf_counter()
+    for piece in template.generate(context):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            rendering += time.perf_counter() - start
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+            start = time.perf_counter()
+    rendering += time.perf_counter() - start
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+    # Só o tempo gasto gerando o HTML; a espera pelo envio de cada pedaço fica de fora
+    metrics.observe_render(template.name, rendering)
+
+def stream_template(templates, name: str, context: dict, status_code: int = 200) -> StreamingResponse:
+    """Como templates.TemplateResponse, mas renderiza com Template.generate e envia em pedaços."""
+    template = templates.get_template(name)
+    return StreamingResponse(_chunks(template, context), status_code=status_code, media_type="text/html; charset=utf-8")
@@ -1,23 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from . import schemas, services
-from .database import get_db
+from typing import List, Optional
+from . import bulk, cache, events, export, pagination, schemas, serialization, services, stats, versions
+from .concurrency import run_db
+from .database import get_db, get_read_db
 
 router = APIRouter()
 
+def _json_list(request: Request, schema, rows, cursor: Optional[str] = None):
+    # Listagens: rows já são dicts e viram JSON de uma vez (serialization.py). Como a resposta é
+    # devolvida pronta, o cursor e os cabeçalhos do conditional_get são aplicados diretamente nela.
+    response = serialization.json_list(schema, rows)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return versions.with_cache_headers(request, response)
+
+def _export_response(statement, fmt: str, name: str):
+    media_type = export.media_type_for(fmt)
+    return StreamingResponse(
+        export.stream_rows(statement, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
 #Rotas para controle de usuários
 @router.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return services.create_user(db=db, user=user)
 
-@router.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = services.get_users(db, skip=skip, limit=limit)
-    return users
+@router.post("/users/bulk", response_model=schemas.BulkResult)
+async def bulk_create_users(request: Request, db: Session = Depends(get_db)):
+    rows = bulk.parse_rows(request.headers.get("content-type"), bulk.body_chunks(request.stream()))
+    return await run_db(services.bulk_create_users, db, rows)
+
+@router.get("/users/", response_model=List[schemas.User], dependencies=[Depends(versions.conditional_get("users"))])
+def read_users(request: Request, skip: int = 0, limit: int = 100, after: Optional[str] = None, db: Session = Depends(get_read_db)):
+    after_id = pagination.decode_id_cursor(after) if after else None
+    users = services.get_users(db, skip=skip, limit=limit, after=after_id, as_rows=True)
+    return _json_list(request, schemas.User, users, pagination.next_id_cursor(users, limit))
+
+@router.get("/users/suggest", response_model=List[schemas.UserSuggestion], dependencies=[Depends(versions.conditional_get("users"))])
+def suggest_users(q: str, limit: int = Query(services.SUGGEST_LIMIT, ge=1, le=50), db: Session = Depends(get_read_db)):
+    return services.suggest_users(db, q=q, limit=limit)
+
+@router.get("/users/export")
+def export_users(format: str = "ndjson"):
+    return _export_response(export.users_statement(), format, "users")
 
-@router.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+@router.get("/users/{user_id}", response_model=schemas.User, dependencies=[Depends(versions.conditional_get("users"))])
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     db_user = services.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -31,22 +64,66 @@ def update_user(user_id: int, user: schemas.UserCreate, db: Session = Depends(ge
 def delete_user(user_id: int, db: Session = Depends(get_db)):
     return services.delete_user(db=db, user_id=user_id)
 
-@router.get("/users/{user_id}/loans", response_model=List[schemas.Loan])
-def read_user_loans(user_id: int, db: Session = Depends(get_db)):
-    return services.get_user_loans(db=db, user_id=user_id)
+@router.get("/users/{user_id}/loans", response_model=List[schemas.LoanDetail], response_model_exclude_unset=True, dependencies=[Depends(versions.conditional_get("loans", "users", "books"))])
+def read_user_loans(request: Request, user_id: int, expand: bool = False, db: Session = Depends(get_read_db)):
+    loans = services.get_user_loans(db=db, user_id=user_id, eager=expand, as_rows=True)
+    return _json_list(request, schemas.LoanDetail, loans)
 
 #Rotas para livros
 @router.post("/books/", response_model=schemas.Book)
 def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
     return services.create_book(db=db, book=book)
 
-@router.get("/books/", response_model=List[schemas.Book])
-def read_books(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    books = services.get_books(db, skip=skip, limit=limit)
-    return books
-
-@router.get("/books/{book_id}", response_model=schemas.Book)
-def read_book(book_id: int, db: Session = Depends(get_db)):
+@router.post("/books/bulk", response_model=schemas.BulkResult)
+async def bulk_create_books(request: Request, db: Session = Depends(get_db)):
+    rows = bulk.parse_rows(request.headers.get("content-type"), bulk.body_chunks(request.stream()))
+    return await run_db(services.bulk_create_books, db, rows)
+
+@router.get("/books/", response_model=List[schemas.Book], dependencies=[Depends(versions.conditional_get("books"))])
+def read_books(request: Request, skip: int = 0, limit: int = 100, after: Optional[str] = None, db: Session = Depends(get_read_db)):
+    after_id = pagination.decode_id_cursor(after) if after else None
+    books = services.get_books(db, skip=skip, limit=limit, after=after_id, as_rows=True)
+    return _json_list(request, schemas.Book, books, pagination.next_id_cursor(books, limit))
+
+@router.get("/books/search", response_model=List[schemas.Book], dependencies=[Depends(versions.conditional_get("books"))])
+def search_books(request: Request, q: str, skip: int = 0, limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_read_db)):
+    books = services.search_books(db, q=q, skip=skip, limit=limit)
+    return _json_list(request, schemas.Book, [dict(book) for book in books])
+
+@router.get("/books/suggest", response_model=List[schemas.BookSuggestion], dependencies=[Depends(versions.conditional_get("books"))])
+def suggest_books(q: str, limit: int = Query(services.SUGGEST_LIMIT, ge=1, le=50), db: Session = Depends(get_read_db)):
+    return services.suggest_books(db, q=q, limit=limit)
+
+@router.get("/books/export")
+def export_books(format: str = "ndjson"):
+    return _export_response(export.books_statement(), format, "books")
+
+@router.get("/books/availability", response_model=List[schemas.BookAvailability], dependencies=[Depends(versions.conditional_get("books"))])
+def read_books_availability(request: Request, ids: str, db: Session = Depends(get_read_db)):
+    # Disponibilidade de vários livros (?ids=1,2,3) em uma consulta, no lugar de uma chamada por livro
+    rows = services.get_books_availability(db, services.parse_book_ids(ids))
+    return _json_list(request, schemas.BookAvailability, rows)
+
+@router.get("/books/availability/stream", response_class=StreamingResponse)
+async def stream_books_availability(ids: Optional[str] = None, db: Session = Depends(get_read_db)):
+    # Server-Sent Events: o estado atual dos livros pedidos (?ids=1,2,3) e depois cada mudança
+    # publicada pelos serviços. Sem ids, acompanha todos os livros, sem estado inicial.
+    book_ids = services.parse_book_ids(ids) if ids else None
+    # Inscreve antes de ler o estado: uma mudança entre a leitura e a inscrição não se perde
+    subscriber = events.availability.subscribe(book_ids)
+    try:
+        snapshot = await run_db(services.get_books_availability, db, book_ids) if book_ids else []
+    except BaseException:
+        events.availability.unsubscribe(subscriber)
+        raise
+    return StreamingResponse(
+        events.stream(subscriber, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/books/{book_id}", response_model=schemas.Book, dependencies=[Depends(versions.conditional_get("books"))])
+def read_book(book_id: int, db: Session = Depends(get_read_db)):
     db_book = services.get_book(db=db, book_id=book_id)
     if db_book is None:
         raise HTTPException(status_code=404, detail="Livro não encontrado")
@@ -60,8 +137,8 @@ def update_book(book_id: int, book: schemas.BookCreate, db: Session = Depends(ge
 def delete_book(book_id: int, db: Session = Depends(get_db)):
     return services.delete_book(db=db, book_id=book_id)
 
-@router.get("/books/{book_id}/availability", response_model=dict)
-def check_book_availability(book_id: int, db: Session = Depends(get_db)):
+@router.get("/books/{book_id}/availability", response_model=dict, dependencies=[Depends(versions.conditional_get("books"))])
+def check_book_availability(book_id: int, db: Session = Depends(get_read_db)):
     available = services.check_book_availability(db=db, book_id=book_id)
     return {"book_id": book_id, "available": available}
 
@@ -70,12 +147,38 @@ def check_book_availability(book_id: int, db: Session = Depends(get_db)):
 def create_loan(loan: schemas.LoanCreate, db: Session = Depends(get_db)):
     return services.create_loan(db=db, loan=loan)
 
-@router.get("/loans/", response_model=List[schemas.Loan])
-def read_loans(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return services.get_loans(db=db, skip=skip, limit=limit)
-
-@router.get("/loans/{loan_id}", response_model=schemas.Loan)
-def read_loan(loan_id: int, db: Session = Depends(get_db)):
+@router.post("/loans/batch", response_model=schemas.LoanBatchResult)
+def create_loans_batch(batch: schemas.LoanBatchCreate, db: Session = Depends(get_db)):
+    return services.create_loans_batch(db=db, batch=batch)
+
+@router.post("/loans/return-batch", response_model=schemas.LoanBatchResult)
+def return_loans_batch(batch: schemas.LoanReturnBatch, db: Session = Depends(get_db)):
+    return services.return_loans_batch(db=db, batch=batch)
+
+@router.get("/loans/", response_model=List[schemas.LoanDetail], response_model_exclude_unset=True, dependencies=[Depends(versions.conditional_get("loans", "users", "books"))])
+def read_loans(request: Request, skip: int = 0, limit: int = 100, after: Optional[str] = None, expand: bool = False, db: Session = Depends(get_read_db)):
+    after_key = pagination.decode_loan_cursor(after) if after else None
+    loans = services.get_loans(db=db, skip=skip, limit=limit, eager=expand, after=after_key, as_rows=True)
+    return _json_list(request, schemas.LoanDetail, loans, pagination.next_loan_cursor(loans, limit))
+
+@router.get("/loans/overdue", response_model=List[schemas.LoanDetail], response_model_exclude_unset=True, dependencies=[Depends(versions.conditional_get("loans", "users", "books", daily=True))])
+def read_overdue_loans(request: Request, skip: int = 0, limit: int = 100, after: Optional[str] = None, expand: bool = False, db: Session = Depends(get_read_db)):
+    after_key = pagination.decode_loan_cursor(after) if after else None
+    loans = services.get_overdue_loans(db=db, skip=skip, limit=limit, eager=expand, after=after_key, as_rows=True)
+    return _json_list(request, schemas.LoanDetail, loans, pagination.next_overdue_cursor(loans, limit))
+
+@router.get("/loans/export")
+def export_loans(
+    format: str = "ndjson",
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    status: Optional[str] = None,
+):
+    statement = export.loans_statement(start_date=start_date, end_date=end_date, status=status)
+    return _export_response(statement, format, "loans")
+
+@router.get("/loans/{loan_id}", response_model=schemas.Loan, dependencies=[Depends(versions.conditional_get("loans"))])
+def read_loan(loan_id: int, db: Session = Depends(get_read_db)):
     db_loan = services.get_loan(db=db, loan_id=loan_id)
     if db_loan is None:
         raise HTTPException(status_code=404, detail="Empréstimo não encontrado")
@@ -91,4 +194,12 @@ def delete_loan(loan_id: int, db: Session = Depends(get_db)):
 
 @router.post("/loans/{loan_id}/return", response_model=schemas.Loan)
 def return_loan(loan_id: int, db: Session = Depends(get_db)):
-    return services.return_loan(db=db, loan_id=loan_id)
\ No newline at end of file
+    return services.return_loan(db=db, loan_id=loan_id)
+
+@router.get("/stats", response_model=schemas.CirculationStats, dependencies=[Depends(versions.conditional_get("loans", "books", daily=True))])
+def read_stats(top: int = Query(stats.STATS_TOP_BOOKS, ge=1, le=100), days: int = Query(stats.STATS_DAYS, ge=1, le=366), db: Session = Depends(get_read_db)):
+    return stats.get_stats(db, top=top, days=days)
+
+@router.get("/cache/stats", response_model=dict)
+def read_cache_stats():
+    return cache.stats()
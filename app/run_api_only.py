@@ -1,16 +1,19 @@
 from fastapi import FastAPI
-from . import models, routes
-from .database import engine
-
-models.Base.metadata.create_all(bind=engine)
+from . import jobs, logs, metrics, routes
 
+# Logging e schema são preparados em jobs.lifespan, ao subir o servidor, não na importação
 app = FastAPI(
     title="Sistema de Gerenciamento de Biblioteca Digital",
     description="API REST para gerenciar usuários, livros e empréstimos.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=jobs.lifespan,
 )
 
+# O middleware de métricas fica por dentro, para o log de lentidão sair com o request id
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(logs.RequestIdMiddleware)
 app.include_router(routes.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 def read_root():
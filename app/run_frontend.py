@@ -1,44 +1,64 @@
-from fastapi import FastAPI, Request, Form, Depends, HTTPException
+from fastapi import FastAPI, Request, Form, Depends, HTTPException, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 from sqlalchemy.orm import Session
-from . import services, schemas, models
-from .database import get_db, engine
+from . import services, schemas, pagination, versions, logs, metrics, jobs, stats, rendering
+from .database import get_db, get_read_db
+from .concurrency import run_db
 import logging
+from typing import List
 from urllib.parse import urlencode
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("frontend")
 
-app = FastAPI()
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@asynccontextmanager
+async def lifespan(app):
+    # Como logging e schema (jobs.lifespan), os arquivos estáticos são montados ao subir o
+    # servidor, e não na importação; os templates são criados na primeira página renderizada
+    if not any(getattr(route, "name", None) == "static" for route in app.routes):
+        app.mount("/static", StaticFiles(directory=rendering.STATIC_DIR), name="static")
+    async with jobs.lifespan(app):
+        yield
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("frontend")
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(logs.RequestIdMiddleware)
+app.include_router(metrics.router)
+
+PAGE_SIZE = 100
 
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request, success: str = None, error: str = None):
+@app.get("/", response_class=HTMLResponse, dependencies=[Depends(versions.conditional_get("loans", "books", daily=True))])
+async def home(request: Request, db: Session = Depends(get_read_db), success: str = None, error: str = None):
     logger.info("Acessando página inicial")
-    return templates.TemplateResponse("index.html", {"request": request, "success": success, "error": error})
+    circulation = await run_db(stats.get_stats, db)
+    return versions.with_cache_headers(request, rendering.get_templates().TemplateResponse("index.html", {"request": request, "success": success, "error": error, "stats": circulation}))
 
-@app.get("/users", response_class=HTMLResponse)
-async def users(request: Request, db: Session = Depends(get_db), success: str = None, error: str = None):
+@app.get("/users", response_class=HTMLResponse, dependencies=[Depends(versions.conditional_get("users"))])
+async def users(request: Request, db: Session = Depends(get_read_db), success: str = None, error: str = None, after: str = None):
     logger.info("Listando usuários")
-    users_list = services.get_users(db)
-    return templates.TemplateResponse("users.html", {"request": request, "users": users_list, "success": success, "error": error})
+    after_id = pagination.decode_id_cursor(after) if after else None
+    users_list = await run_db(services.get_users, db, limit=PAGE_SIZE, after=after_id)
+    next_cursor = pagination.next_id_cursor(users_list, PAGE_SIZE)
+    return versions.with_cache_headers(request, rendering.stream_template(rendering.get_templates(), "users.html", {
+        "request": request, "users": users_list, "success": success, "error": error,
+        "after": after, "next_cursor": next_cursor, "page_url": "/users"
+    }))
 
-@app.get("/books", response_class=HTMLResponse)
-async def books(request: Request, db: Session = Depends(get_db), success: str = None, error: str = None):
+@app.get("/books", response_class=HTMLResponse, dependencies=[Depends(versions.conditional_get("books"))])
+async def books(request: Request, db: Session = Depends(get_read_db), success: str = None, error: str = None, after: str = None):
     logger.info("Listando livros")
-    books_list = services.get_books(db)
-    return templates.TemplateResponse("books.html", {"request": request, "books": books_list, "success": success, "error": error})
+    after_id = pagination.decode_id_cursor(after) if after else None
+    books_list = await run_db(services.get_books, db, limit=PAGE_SIZE, after=after_id)
+    next_cursor = pagination.next_id_cursor(books_list, PAGE_SIZE)
+    return versions.with_cache_headers(request, rendering.stream_template(rendering.get_templates(), "books.html", {
+        "request": request, "books": books_list, "success": success, "error": error,
+        "after": after, "next_cursor": next_cursor, "page_url": "/books"
+    }))
 
 @app.get("/users/new", response_class=HTMLResponse)
 async def new_user_form(request: Request):
-    return templates.TemplateResponse("user_form.html", {"request": request, "user": None, "error": None})
+    return rendering.get_templates().TemplateResponse("user_form.html", {"request": request, "user": None, "error": None})
 
 @app.post("/users/new", response_class=HTMLResponse)
 async def create_user(
@@ -48,20 +68,20 @@ async def create_user(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Criando usuário: {name}, {email}")
+        logger.info("Criando usuário: %s, %s", name, email)
         user_data = schemas.UserCreate(name=name, email=email)
-        services.create_user(db, user_data)
+        await run_db(services.create_user, db, user_data)
         success_message = urlencode({"success": "Usuário criado com sucesso!"})
         return RedirectResponse(f"/users?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao criar usuário: {e.detail}")
-        return templates.TemplateResponse("user_form.html", {"request": request, "user": None, "error": e.detail})
+        logger.error("Erro ao criar usuário: %s", e.detail)
+        return rendering.get_templates().TemplateResponse("user_form.html", {"request": request, "user": None, "error": e.detail})
 
 @app.get("/users/{user_id}/edit", response_class=HTMLResponse)
-async def edit_user_form(request: Request, user_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Editando usuário id={user_id}")
-    user = services.get_user(db, user_id)
-    return templates.TemplateResponse("user_form.html", {"request": request, "user": user, "error": None})
+async def edit_user_form(request: Request, user_id: int, db: Session = Depends(get_read_db)):
+    logger.info("Editando usuário id=%s", user_id)
+    user = await run_db(services.get_user, db, user_id)
+    return rendering.get_templates().TemplateResponse("user_form.html", {"request": request, "user": user, "error": None})
 
 @app.post("/users/{user_id}/edit", response_class=HTMLResponse)
 async def update_user(
@@ -72,43 +92,60 @@ async def update_user(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Atualizando usuário id={user_id}")
+        logger.info("Atualizando usuário id=%s", user_id)
         user_data = schemas.UserCreate(name=name, email=email)
-        services.update_user(db, user_id, user_data)
+        await run_db(services.update_user, db, user_id, user_data)
         success_message = urlencode({"success": "Usuário atualizado com sucesso!"})
         return RedirectResponse(f"/users?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao atualizar usuário: {e.detail}")
+        logger.error("Erro ao atualizar usuário: %s", e.detail)
         user = {"id": user_id, "name": name, "email": email} # Re-populate form with submitted data
-        return templates.TemplateResponse("user_form.html", {"request": request, "user": user, "error": e.detail})
+        return rendering.get_templates().TemplateResponse("user_form.html", {"request": request, "user": user, "error": e.detail})
 
 @app.post("/users/{user_id}/delete", response_class=HTMLResponse)
 async def delete_user(request: Request, user_id: int, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Removendo usuário id={user_id}")
-        services.delete_user(db, user_id)
+        logger.info("Removendo usuário id=%s", user_id)
+        await run_db(services.delete_user, db, user_id)
         success_message = urlencode({"success": "Usuário removido com sucesso!"})
         return RedirectResponse(f"/users?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao remover usuário: {e.detail}")
+        logger.error("Erro ao remover usuário: %s", e.detail)
         error_message = urlencode({"error": e.detail})
         return RedirectResponse(f"/users?{error_message}", status_code=303)
 
 
-@app.get("/loans", response_class=HTMLResponse)
-async def loans(request: Request, db: Session = Depends(get_db), success: str = None, error: str = None):
+@app.get("/loans", response_class=HTMLResponse, dependencies=[Depends(versions.conditional_get("loans", "users", "books"))])
+async def loans(request: Request, db: Session = Depends(get_read_db), success: str = None, error: str = None, after: str = None):
     logger.info("Listando empréstimos")
-    loans_list = services.get_loans(db)
-    return templates.TemplateResponse("loans.html", {"request": request, "loans": loans_list, "success": success, "error": error})
+    after_key = pagination.decode_loan_cursor(after) if after else None
+    loans_list = await run_db(services.get_loans, db, limit=PAGE_SIZE, eager=True, after=after_key)
+    next_cursor = pagination.next_loan_cursor(loans_list, PAGE_SIZE)
+    return versions.with_cache_headers(request, rendering.stream_template(rendering.get_templates(), "loans.html", {
+        "request": request, "loans": loans_list, "success": success, "error": error,
+        "after": after, "next_cursor": next_cursor, "page_url": "/loans"
+    }))
+
+async def _loan_form(request: Request, db: Session, loan, user_id: int = None, book_id: int = None, error: str = None):
+    # O formulário só carrega o usuário e o livro já escolhidos; os demais vêm de /users/suggest e /books/suggest
+    user = await run_db(services.get_user, db, user_id) if user_id else None
+    book = await run_db(services.get_book, db, book_id) if book_id else None
+    return rendering.get_templates().TemplateResponse("loan_form.html", {
+        "request": request, "loan": loan, "user": user, "book": book, "error": error
+    })
+
+@app.get("/users/suggest", response_model=List[schemas.UserSuggestion], dependencies=[Depends(versions.conditional_get("users"))])
+async def suggest_users(q: str, limit: int = Query(services.SUGGEST_LIMIT, ge=1, le=50), db: Session = Depends(get_read_db)):
+    return await run_db(services.suggest_users, db, q, limit)
+
+@app.get("/books/suggest", response_model=List[schemas.BookSuggestion], dependencies=[Depends(versions.conditional_get("books"))])
+async def suggest_books(q: str, limit: int = Query(services.SUGGEST_LIMIT, ge=1, le=50), db: Session = Depends(get_read_db)):
+    return await run_db(services.suggest_books, db, q, limit)
 
 @app.get("/loans/new", response_class=HTMLResponse)
-async def new_loan_form(request: Request, db: Session = Depends(get_db)):
+async def new_loan_form(request: Request, db: Session = Depends(get_read_db)):
     logger.info("Exibindo formulário de novo empréstimo")
-    users = services.get_users(db)
-    books = services.get_books(db)
-    return templates.TemplateResponse("loan_form.html", {
-        "request": request, "loan": None, "users": users, "books": books, "error": None
-    })
+    return await _loan_form(request, db, None)
 
 @app.post("/loans/new", response_class=HTMLResponse)
 async def create_loan(
@@ -118,31 +155,23 @@ async def create_loan(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Criando empréstimo: user_id={user_id}, book_id={book_id}")
+        logger.info("Criando empréstimo: user_id=%s, book_id=%s", user_id, book_id)
         loan_data = schemas.LoanCreate(user_id=user_id, book_id=book_id)
-        services.create_loan(db, loan_data)
+        await run_db(services.create_loan, db, loan_data)
         success_message = urlencode({"success": "Empréstimo realizado com sucesso!"})
         return RedirectResponse(f"/loans?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao criar empréstimo: {e.detail}")
-        users = services.get_users(db)
-        books = services.get_books(db)
-        return templates.TemplateResponse("loan_form.html", {
-            "request": request, "loan": None, "users": users, "books": books, "error": e.detail
-        })
+        logger.error("Erro ao criar empréstimo: %s", e.detail)
+        return await _loan_form(request, db, None, user_id, book_id, e.detail)
 
 @app.get("/loans/{loan_id}/edit", response_class=HTMLResponse)
-async def edit_loan_form(request: Request, loan_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Editando empréstimo id={loan_id}")
-    loan = services.get_loan(db, loan_id)
-    users = services.get_users(db)
-    books = services.get_books(db)
-    error = None if loan else "Empréstimo não encontrado."
+async def edit_loan_form(request: Request, loan_id: int, db: Session = Depends(get_read_db)):
+    logger.info("Editando empréstimo id=%s", loan_id)
+    loan = await run_db(services.get_loan, db, loan_id)
     if not loan:
-        logger.error(f"Empréstimo id={loan_id} não encontrado")
-    return templates.TemplateResponse("loan_form.html", {
-        "request": request, "loan": loan, "users": users, "books": books, "error": error
-    })
+        logger.error("Empréstimo id=%s não encontrado", loan_id)
+        return await _loan_form(request, db, None, error="Empréstimo não encontrado.")
+    return await _loan_form(request, db, loan, loan.user_id, loan.book_id)
 
 @app.post("/loans/{loan_id}/edit", response_class=HTMLResponse)
 async def update_loan(
@@ -153,47 +182,43 @@ async def update_loan(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Atualizando empréstimo id={loan_id}")
+        logger.info("Atualizando empréstimo id=%s", loan_id)
         loan_data = schemas.LoanCreate(user_id=user_id, book_id=book_id)
-        services.update_loan(db, loan_id, loan_data)
+        await run_db(services.update_loan, db, loan_id, loan_data)
         success_message = urlencode({"success": "Empréstimo atualizado com sucesso!"})
         return RedirectResponse(f"/loans?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao atualizar empréstimo: {e.detail}")
-        loan = services.get_loan(db, loan_id)
-        users = services.get_users(db)
-        books = services.get_books(db)
-        return templates.TemplateResponse("loan_form.html", {
-            "request": request, "loan": loan, "users": users, "books": books, "error": e.detail
-        })
+        logger.error("Erro ao atualizar empréstimo: %s", e.detail)
+        loan = await run_db(services.get_loan, db, loan_id)
+        return await _loan_form(request, db, loan, user_id, book_id, e.detail)
 
 @app.post("/loans/{loan_id}/delete", response_class=HTMLResponse)
 async def delete_loan(request: Request, loan_id: int, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Removendo empréstimo id={loan_id}")
-        services.delete_loan(db, loan_id)
+        logger.info("Removendo empréstimo id=%s", loan_id)
+        await run_db(services.delete_loan, db, loan_id)
         success_message = urlencode({"success": "Empréstimo removido com sucesso!"})
         return RedirectResponse(f"/loans?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao remover empréstimo: {e.detail}")
+        logger.error("Erro ao remover empréstimo: %s", e.detail)
         error_message = urlencode({"error": e.detail})
         return RedirectResponse(f"/loans?{error_message}", status_code=303)
 
 @app.post("/loans/{loan_id}/return", response_class=HTMLResponse)
 async def return_loan(request: Request, loan_id: int, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Devolvendo empréstimo id={loan_id}")
-        services.return_loan(db, loan_id)
+        logger.info("Devolvendo empréstimo id=%s", loan_id)
+        await run_db(services.return_loan, db, loan_id)
         success_message = urlencode({"success": "Devolução registrada com sucesso!"})
         return RedirectResponse(f"/loans?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao devolver empréstimo: {e.detail}")
+        logger.error("Erro ao devolver empréstimo: %s", e.detail)
         error_message = urlencode({"error": e.detail})
         return RedirectResponse(f"/loans?{error_message}", status_code=303)
 
 @app.get("/books/new", response_class=HTMLResponse)
 async def new_book_form(request: Request):
-    return templates.TemplateResponse("book_form.html", {"request": request, "book": None, "error": None})
+    return rendering.get_templates().TemplateResponse("book_form.html", {"request": request, "book": None, "error": None})
 
 @app.post("/books/new", response_class=HTMLResponse)
 async def create_book(
@@ -204,20 +229,20 @@ async def create_book(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Criando livro: {title}")
+        logger.info("Criando livro: %s", title)
         book_data = schemas.BookCreate(title=title, author=author, quantity=quantity)
-        services.create_book(db, book_data)
+        await run_db(services.create_book, db, book_data)
         success_message = urlencode({"success": "Livro criado com sucesso!"})
         return RedirectResponse(f"/books?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao criar livro: {e.detail}")
-        return templates.TemplateResponse("book_form.html", {"request": request, "book": None, "error": e.detail})
+        logger.error("Erro ao criar livro: %s", e.detail)
+        return rendering.get_templates().TemplateResponse("book_form.html", {"request": request, "book": None, "error": e.detail})
 
 @app.get("/books/{book_id}/edit", response_class=HTMLResponse)
-async def edit_book_form(request: Request, book_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Editando livro id={book_id}")
-    book = services.get_book(db, book_id)
-    return templates.TemplateResponse("book_form.html", {"request": request, "book": book, "error": None})
+async def edit_book_form(request: Request, book_id: int, db: Session = Depends(get_read_db)):
+    logger.info("Editando livro id=%s", book_id)
+    book = await run_db(services.get_book, db, book_id)
+    return rendering.get_templates().TemplateResponse("book_form.html", {"request": request, "book": book, "error": None})
 
 @app.post("/books/{book_id}/edit", response_class=HTMLResponse)
 async def update_book(
@@ -229,36 +254,36 @@ async def update_book(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Atualizando livro id={book_id}")
+        logger.info("Atualizando livro id=%s", book_id)
         book_data = schemas.BookCreate(title=title, author=author, quantity=quantity)
-        services.update_book(db, book_id, book_data)
+        await run_db(services.update_book, db, book_id, book_data)
         success_message = urlencode({"success": "Livro atualizado com sucesso!"})
         return RedirectResponse(f"/books?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao atualizar livro: {e.detail}")
+        logger.error("Erro ao atualizar livro: %s", e.detail)
         book = {"id": book_id, "title": title, "author": author, "quantity": quantity}
-        return templates.TemplateResponse("book_form.html", {"request": request, "book": book, "error": e.detail})
+        return rendering.get_templates().TemplateResponse("book_form.html", {"request": request, "book": book, "error": e.detail})
 
 @app.post("/books/{book_id}/delete", response_class=HTMLResponse)
 async def delete_book(request: Request, book_id: int, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Removendo livro id={book_id}")
-        services.delete_book(db, book_id)
+        logger.info("Removendo livro id=%s", book_id)
+        await run_db(services.delete_book, db, book_id)
         success_message = urlencode({"success": "Livro removido com sucesso!"})
         return RedirectResponse(f"/books?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao remover livro: {e.detail}")
+        logger.error("Erro ao remover livro: %s", e.detail)
         error_message = urlencode({"error": e.detail})
         return RedirectResponse(f"/books?{error_message}", status_code=303)
 
 @app.post("/loans/{loan_id}/undo-return", response_class=HTMLResponse)
 async def undo_loan_return(request: Request, loan_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Desfazendo devolução do empréstimo id={loan_id}")
+    logger.info("Desfazendo devolução do empréstimo id=%s", loan_id)
     try:
-        services.undo_loan_return(db, loan_id)
+        await run_db(services.undo_loan_return, db, loan_id)
         success_message = urlencode({"success": "Devolução desfeita com sucesso!"})
         return RedirectResponse(f"/loans?{success_message}", status_code=303)
     except HTTPException as e:
-        logger.error(f"Erro ao desfazer devolução: {e.detail}")
+        logger.error("Erro ao desfazer devolução: %s", e.detail)
         error_message = urlencode({"error": e.detail})
         return RedirectResponse(f"/loans?{error_message}", status_code=303)
\ No newline at end of file
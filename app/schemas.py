@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 import datetime
 
@@ -12,8 +12,7 @@ class UserCreate(UserBase):
 class User(UserBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BookBase(BaseModel):
     title: str
@@ -25,9 +24,14 @@ class BookCreate(BookBase):
 
 class Book(BookBase):
     id: int
+    available_copies: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class BookAvailability(BaseModel):
+    book_id: int
+    available: bool
+    available_copies: int
 
 class LoanBase(BaseModel):
     user_id: int
@@ -43,5 +47,92 @@ class Loan(LoanBase):
     return_date: Optional[datetime.date]
     fine: float
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+# Limite de itens por lote em POST /loans/batch e /loans/return-batch
+MAX_LOAN_BATCH_ITEMS = 100
+
+class LoanBatchCreate(BaseModel):
+    user_id: int
+    book_ids: List[int] = Field(min_length=1, max_length=MAX_LOAN_BATCH_ITEMS)
+    # True: nada é gravado se algum item falhar; False: grava os itens válidos
+    atomic: bool = True
+
+class LoanReturnBatch(BaseModel):
+    loan_ids: List[int] = Field(min_length=1, max_length=MAX_LOAN_BATCH_ITEMS)
+    atomic: bool = True
+
+class LoanBatchItem(BaseModel):
+    # status: "created" ou "returned", "failed" (com error) ou "skipped" (lote atômico não aplicado)
+    book_id: Optional[int] = None
+    loan_id: Optional[int] = None
+    status: str
+    error: Optional[str] = None
+    loan: Optional[Loan] = None
+
+class LoanBatchResult(BaseModel):
+    committed: bool
+    succeeded: int
+    failed: int
+    items: List[LoanBatchItem]
+
+class LoanUser(BaseModel):
+    id: int
+    name: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class LoanBook(BaseModel):
+    id: int
+    title: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class LoanDetail(Loan):
+    # Preenchidos apenas quando a listagem é feita com expand=true (carregamento antecipado)
+    user: Optional[LoanUser] = None
+    book: Optional[LoanBook] = None
+
+class BulkRowError(BaseModel):
+    row: int
+    error: str
+
+class BulkResult(BaseModel):
+    received: int
+    created: int
+    failed: int
+    errors: List[BulkRowError]
+
+class TopBook(BaseModel):
+    id: int
+    title: str
+    author: str
+    total_loans: int
+
+class DailyCheckout(BaseModel):
+    day: datetime.date
+    checkouts: int
+
+class CirculationStats(BaseModel):
+    total_loans: int
+    active_loans: int
+    returned_loans: int
+    users_with_active_loans: int
+    active_loans_per_user: float
+    total_fines: float
+    top_books: List[TopBook]
+    daily_checkouts: List[DailyCheckout]
+
+class UserSuggestion(BaseModel):
+    id: int
+    name: str
+    email: str
+    active_loans: int
+    can_borrow: bool
+
+class BookSuggestion(BaseModel):
+    id: int
+    title: str
+    author: str
+    quantity: int
+    available: int
@@ -0,0 +1,36 @@
+import types
+from functools import lru_cache
+from typing import List, Union, get_args, get_origin
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
+
+# Caminho rápido das listagens da API: as linhas vêm do banco como dicts (Core, sem ORM) e a
+# lista inteira vira JSON em uma chamada a TypeAdapter.dump_json, sem instanciar um modelo
+# Pydantic por linha. Os schemas continuam sendo a fonte do formato (e do OpenAPI): o TypedDict
+# usado na serialização é derivado dos campos de cada schema.
+
+def _row_annotation(annotation):
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return row_type(annotation)
+    if get_origin(annotation) in (Union, types.UnionType):
+        return Union[tuple(_row_annotation(arg) for arg in get_args(annotation))]
+    return annotation
+
+@lru_cache(maxsize=None)
+def row_type(schema):
+    fields = {name: _row_annotation(field.annotation) for name, field in schema.model_fields.items()}
+    # total=False: campos ausentes (ex.: user/book sem expand) não aparecem no JSON, como em exclude_unset
+    return TypedDict(f"{schema.__name__}Row", fields, total=False)
+
+@lru_cache(maxsize=None)
+def list_adapter(schema) -> TypeAdapter:
+    return TypeAdapter(List[row_type(schema)])
+
+def as_dicts(result) -> list:
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+def json_list(schema, rows) -> Response:
+    """Serializa rows (dicts com os campos de schema) sem validação, direto para bytes JSON."""
+    return Response(content=list_adapter(schema).dump_json(rows), media_type="application/json")
@@ -1,22 +1,61 @@
 import logging
-from sqlalchemy.orm import Session
-from . import models, schemas
+import re
+from collections import Counter
+from itertools import islice
+from operator import attrgetter, itemgetter
+from functools import lru_cache
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import Integer, bindparam, cast, func, literal, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from typing import Iterable, List, Optional, Tuple
+from . import archive, cache, events, models, schemas, serialization, stats, versions
+from .database import begin_immediate, retry_on_busy
 from datetime import date, timedelta
 from fastapi import HTTPException
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Logger das leituras mais frequentes, para poder amostrá-lo separadamente (LOG_SAMPLE)
+read_logger = logging.getLogger(__name__ + ".reads")
 
-def get_user(db: Session, user_id: int):
-    logger.info(f"Buscando usuário com id={user_id}")
-    return db.query(models.User).filter(models.User.id == user_id).first()
+MAX_ACTIVE_LOANS_PER_USER = 3
+FINE_PER_DAY = 2.00 # R$ 2,00 por dia de atraso
+BULK_CHUNK_SIZE = 5000
+FINE_JOB_CHUNK_SIZE = 50000
+SUGGEST_LIMIT = 10
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    logger.info(f"Listando usuários: skip={skip}, limit={limit}")
-    return db.query(models.User).offset(skip).limit(limit).all()
+def _adjust_active_loans(db: Session, user_id: int, book_id: int, delta: int):
+    # Atualiza os contadores na mesma transação da alteração do empréstimo
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.active_loans: models.User.active_loans + delta}, synchronize_session="evaluate"
+    )
+    db.query(models.Book).filter(models.Book.id == book_id).update(
+        {models.Book.active_loans: models.Book.active_loans + delta}, synchronize_session="evaluate"
+    )
+
+def get_user(db: Session, user_id: int, fresh: bool = False):
+    read_logger.info("Buscando usuário com id=%s", user_id)
+    query = db.query(models.User).filter(models.User.id == user_id)
+    if fresh:
+        return query.first()
+    return cache.read_through(("user", user_id), query.first, models.User, version=versions.table_version(db, "users"))
+
+def _schema_rows(db: Session, query, model, schema):
+    # Caminho rápido das listagens: só as colunas do schema, como dicts, sem instâncias do ORM
+    # (label: campos derivados, como Book.available_copies, são expressões sem nome próprio)
+    columns = [getattr(model, name).label(name) for name in schema.model_fields]
+    return serialization.as_dicts(db.execute(query.with_entities(*columns).statement))
+
+def get_users(db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None, as_rows: bool = False):
+    read_logger.info("Listando usuários: skip=%s, limit=%s, after=%s", skip, limit, after)
+    query = db.query(models.User)
+    if after is not None:
+        query = query.filter(models.User.id > after)
+    query = query.order_by(models.User.id).offset(skip).limit(limit)
+    return _schema_rows(db, query, models.User, schemas.User) if as_rows else query.all()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    logger.info(f"Criando usuário: name={user.name}, email={user.email}")
+    logger.info("Criando usuário: name=%s, email=%s", user.name, user.email)
     existing_user = db.query(models.User).filter(models.User.email == user.email).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email já cadastrado.")
@@ -24,13 +63,13 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    logger.info(f"Usuário criado com id={db_user.id}")
+    logger.info("Usuário criado com id=%s", db_user.id)
     return db_user
 
 def update_user(db: Session, user_id: int, user: schemas.UserCreate):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
-        logger.error(f"Usuário id={user_id} não encontrado para atualização")
+        logger.error("Usuário id=%s não encontrado para atualização", user_id)
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
     existing_user_email = db.query(models.User).filter(models.User.email == user.email, models.User.id != user_id).first()
@@ -40,180 +79,706 @@ def update_user(db: Session, user_id: int, user: schemas.UserCreate):
     db_user.name = user.name
     db_user.email = user.email
     db.commit()
+    cache.invalidate(("user", user_id))
     db.refresh(db_user)
-    logger.info(f"Usuário id={user_id} atualizado")
+    logger.info("Usuário id=%s atualizado", user_id)
     return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
-        logger.error(f"Usuário id={user_id} não encontrado para remoção")
+        logger.error("Usuário id=%s não encontrado para remoção", user_id)
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
-    active_loans = db.query(models.Loan).filter(models.Loan.user_id == user_id, models.Loan.return_date == None).count()
-    if active_loans > 0:
+    if db_user.active_loans > 0:
         raise HTTPException(status_code=400, detail="Usuário possui empréstimos ativos e não pode ser removido.")
 
     db.delete(db_user)
     db.commit()
-    logger.info(f"Usuário id={user_id} removido")
+    cache.invalidate(("user", user_id))
+    logger.info("Usuário id=%s removido", user_id)
     return {"detail": "Usuário removido"}
 
-def get_book(db: Session, book_id: int):
-    logger.info(f"Buscando livro com id={book_id}")
-    return db.query(models.Book).filter(models.Book.id == book_id).first()
+def get_book(db: Session, book_id: int, fresh: bool = False):
+    read_logger.info("Buscando livro com id=%s", book_id)
+    query = db.query(models.Book).filter(models.Book.id == book_id)
+    if fresh:
+        return query.first()
+    return cache.read_through(("book", book_id), query.first, models.Book, version=versions.table_version(db, "books"))
 
-def get_books(db: Session, skip: int = 0, limit: int = 100):
-    logger.info(f"Listando livros: skip={skip}, limit={limit}")
-    return db.query(models.Book).offset(skip).limit(limit).all()
+def get_books(db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None, as_rows: bool = False):
+    read_logger.info("Listando livros: skip=%s, limit=%s, after=%s", skip, limit, after)
+    query = db.query(models.Book)
+    if after is not None:
+        query = query.filter(models.Book.id > after)
+    query = query.order_by(models.Book.id).offset(skip).limit(limit)
+    return _schema_rows(db, query, models.Book, schemas.Book) if as_rows else query.all()
 
 def create_book(db: Session, book: schemas.BookCreate):
-    logger.info(f"Criando livro: title={book.title}, author={book.author}, quantity={book.quantity}")
-    db_book = models.Book(**book.dict())
+    logger.info("Criando livro: title=%s, author=%s, quantity=%s", book.title, book.author, book.quantity)
+    db_book = models.Book(**book.model_dump())
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
-    logger.info(f"Livro criado com id={db_book.id}")
+    logger.info("Livro criado com id=%s", db_book.id)
     return db_book
 
 def update_book(db: Session, book_id: int, book: schemas.BookCreate):
     db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if not db_book:
-        logger.error(f"Livro id={book_id} não encontrado para atualização")
+        logger.error("Livro id=%s não encontrado para atualização", book_id)
         raise HTTPException(status_code=404, detail="Livro não encontrado")
     db_book.title = book.title
     db_book.author = book.author
     db_book.quantity = book.quantity
     db.commit()
+    cache.invalidate(("book", book_id))
+    _publish_availability(db, book_id)
     db.refresh(db_book)
-    logger.info(f"Livro id={book_id} atualizado")
+    logger.info("Livro id=%s atualizado", book_id)
     return db_book
 
 def delete_book(db: Session, book_id: int):
     db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if not db_book:
-        logger.error(f"Livro id={book_id} não encontrado para remoção")
+        logger.error("Livro id=%s não encontrado para remoção", book_id)
         raise HTTPException(status_code=404, detail="Livro não encontrado")
     
-    active_loans = db.query(models.Loan).filter(models.Loan.book_id == book_id, models.Loan.return_date == None).count()
-    if active_loans > 0:
+    if db_book.active_loans > 0:
         raise HTTPException(status_code=400, detail="Este livro possui empréstimos ativos e não pode ser removido.")
 
     db.delete(db_book)
     db.commit()
-    logger.info(f"Livro id={book_id} removido")
+    cache.invalidate(("book", book_id))
+    logger.info("Livro id=%s removido", book_id)
     return {"detail": "Livro removido"}
 
-def check_book_availability(db: Session, book_id: int):
-    logger.info(f"Verificando disponibilidade do livro id={book_id}")
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+_SEARCH_TOKEN = re.compile(r"\w+", re.UNICODE)
+_BOOK_SEARCH_COLUMNS = (
+    "books.id, books.title, books.author, books.quantity, "
+    "max(books.quantity - books.active_loans, 0) AS available_copies"
+)
+
+def _fts_terms(q: str):
+    # Cada palavra vira um termo entre aspas, então operadores do FTS5 digitados pelo usuário são ignorados
+    return [f'"{token}"' for token in _SEARCH_TOKEN.findall(q)]
+
+def search_books(db: Session, q: str, skip: int = 0, limit: int = 20):
+    read_logger.info("Buscando livros: q=%r, skip=%s, limit=%s", q, skip, limit)
+    terms = _fts_terms(q)
+    if not terms:
+        return []
+    exact = " ".join(terms)
+    # 1) Palavras completas, ordenadas por bm25 (peso maior para o título do que para o autor)
+    rows = db.execute(
+        text(
+            f"SELECT {_BOOK_SEARCH_COLUMNS} FROM books_fts JOIN books ON books.id = books_fts.rowid "
+            "WHERE books_fts MATCH :match ORDER BY bm25(books_fts, 10.0, 5.0) LIMIT :limit OFFSET :skip"
+        ),
+        {"match": exact, "limit": limit, "skip": skip},
+    ).mappings().all()
+    if len(rows) == limit:
+        return rows
+    # 2) Completa com os títulos em que a última palavra é só prefixo. Ranquear todos os
+    #    documentos de um prefixo curto custa caro em catálogos grandes, então essa parte sai na ordem do índice.
+    exact_total = db.execute(text("SELECT count(*) FROM books_fts WHERE books_fts MATCH :match"), {"match": exact}).scalar()
+    prefix_only = f"({' '.join(terms[:-1] + [terms[-1] + '*'])}) NOT ({exact})"
+    rows += db.execute(
+        text(
+            f"SELECT {_BOOK_SEARCH_COLUMNS} FROM books_fts JOIN books ON books.id = books_fts.rowid "
+            "WHERE books_fts MATCH :match LIMIT :limit OFFSET :skip"
+        ),
+        {"match": prefix_only, "limit": limit - len(rows), "skip": max(0, skip - exact_total)},
+    ).mappings().all()
+    return rows
+
+def _prefix_range(column, prefix: str):
+    # Chave de busca entre o prefixo e o próximo prefixo possível: uma faixa no índice da coluna,
+    # ao contrário de LIKE 'abc%', que o SQLite não resolve pelo índice com o collation padrão
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return column >= prefix, column < upper
+
+def suggest_users(db: Session, q: str, limit: int = SUGGEST_LIMIT):
+    read_logger.info("Sugerindo usuários: q=%r, limit=%s", q, limit)
+    prefix = models.search_key(" ".join(q.split()))
+    if not prefix:
+        return []
+    # Os primeiros por prefixo do nome e do email, unidos e ordenados pelo nome
+    found = {}
+    for column in (models.User.name_key, models.User.email_key):
+        matches = (
+            db.query(models.User).filter(*_prefix_range(column, prefix))
+            .order_by(column).limit(limit).all()
+        )
+        for user in matches:
+            found.setdefault(user.id, user)
+    users = sorted(found.values(), key=lambda user: (user.name_key, user.id))[:limit]
+    return [
+        {
+            "id": user.id, "name": user.name, "email": user.email, "active_loans": user.active_loans,
+            "can_borrow": user.active_loans < MAX_ACTIVE_LOANS_PER_USER,
+        }
+        for user in users
+    ]
+
+def suggest_books(db: Session, q: str, limit: int = SUGGEST_LIMIT):
+    read_logger.info("Sugerindo livros: q=%r, limit=%s", q, limit)
+    prefix = models.search_key(" ".join(q.split()))
+    if not prefix:
+        return []
+    # 1) Títulos que começam com o texto digitado
+    books = (
+        db.query(models.Book).filter(*_prefix_range(models.Book.title_key, prefix))
+        .order_by(models.Book.title_key).limit(limit).all()
+    )
+    # 2) Completa com prefixos de palavras do título ou do autor (índice de prefixos do FTS5)
+    terms = _fts_terms(q)
+    if len(books) < limit and terms:
+        seen = {book.id for book in books}
+        ids = db.execute(
+            text("SELECT rowid FROM books_fts WHERE books_fts MATCH :match LIMIT :limit"),
+            {"match": " ".join(f"{term}*" for term in terms), "limit": limit + len(books)},
+        ).scalars().all()
+        extra = [book_id for book_id in ids if book_id not in seen][:limit - len(books)]
+        if extra:
+            books += db.query(models.Book).filter(models.Book.id.in_(extra)).order_by(models.Book.id).all()
+    return [
+        {
+            "id": book.id, "title": book.title, "author": book.author, "quantity": book.quantity,
+            "available": book.available_copies,
+        }
+        for book in books
+    ]
+
+# Ids por requisição em GET /books/availability e /books/availability/stream
+MAX_AVAILABILITY_IDS = 1000
+
+def parse_book_ids(value: str, limit: int = MAX_AVAILABILITY_IDS) -> List[int]:
+    # Lista de ids na query string (?ids=1,2,3), sem repetidos e na ordem pedida
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids deve ser uma lista de números separados por vírgula.")
+    if len(ids) > limit:
+        raise HTTPException(status_code=400, detail=f"No máximo {limit} ids por requisição.")
+    return ids
+
+def get_books_availability(db: Session, book_ids: List[int]) -> List[dict]:
+    # Uma consulta pela chave primária para a lista toda; active_loans é o contador mantido a cada
+    # empréstimo/devolução, então não há agregação sobre loans. Ids inexistentes ficam de fora.
+    read_logger.info("Disponibilidade de %s livros", len(book_ids))
+    rows = db.execute(
+        select(models.Book.id, models.Book.available_copies).where(models.Book.id.in_(book_ids))
+    ).all()
+    by_id = {
+        book_id: {"book_id": book_id, "available": copies > 0, "available_copies": copies}
+        for book_id, copies in rows
+    }
+    return [by_id[book_id] for book_id in book_ids if book_id in by_id]
+
+def _publish_availability(db: Session, *book_ids: int):
+    # Chamado depois do commit. Sem inscritos acompanhando esses livros, não custa consulta.
+    watched = events.availability.interested(book_ids)
+    if watched:
+        events.availability.publish(get_books_availability(db, watched))
+
+def check_book_availability(db: Session, book_id: int, fresh: bool = False):
+    # Leituras usam o cache; create_loan e undo_loan_return pedem fresh=True para checar o estado atual
+    read_logger.info("Verificando disponibilidade do livro id=%s", book_id)
+    book = get_book(db, book_id, fresh=fresh)
     if not book:
-        logger.warning(f"Livro id={book_id} não encontrado")
+        logger.warning("Livro id=%s não encontrado", book_id)
         return False
     
-    active_loans = db.query(models.Loan).filter(models.Loan.book_id == book_id, models.Loan.return_date == None).count()
-    available = book.quantity > active_loans
-    logger.info(f"Livro id={book_id} disponível: {available} (quantidade={book.quantity}, empréstimos ativos={active_loans})")
+    available = book.quantity > book.active_loans
+    read_logger.info("Livro id=%s disponível: %s (quantidade=%s, empréstimos ativos=%s)", book_id, available, book.quantity, book.active_loans)
     return available
 
-def create_loan(db: Session, loan: schemas.LoanCreate):
-    logger.info(f"Tentando criar empréstimo: user_id={loan.user_id}, book_id={loan.book_id}")
-    user = get_user(db, loan.user_id)
-    if not user:
-        logger.error(f"Usuário id={loan.user_id} não encontrado")
-        raise HTTPException(status_code=404, detail="Usuário não encontrado")
-
-    if not check_book_availability(db, loan.book_id):
-        logger.error(f"Livro id={loan.book_id} não disponível para empréstimo")
-        raise HTTPException(status_code=400, detail="Livro não disponível para empréstimo.")
+def _take_copy_and_slot(db: Session, user_id: int, book_id: int):
+    # Cada UPDATE só altera a linha se a regra ainda vale; rowcount 0 = regra violada (ou id inexistente).
+    # Verificação e reserva são a mesma instrução, então duas requisições não levam a última cópia.
+    book_taken = db.execute(
+        update(models.Book)
+        .where(models.Book.id == book_id, models.Book.active_loans < models.Book.quantity)
+        .values(active_loans=models.Book.active_loans + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not book_taken:
+        if not db.query(models.User.id).filter(models.User.id == user_id).first():
+            return 404, "Usuário não encontrado"
+        return 400, "Livro não disponível para empréstimo."
+    slot_taken = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.active_loans < MAX_ACTIVE_LOANS_PER_USER)
+        .values(active_loans=models.User.active_loans + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not slot_taken:
+        if not db.query(models.User.id).filter(models.User.id == user_id).first():
+            return 404, "Usuário não encontrado"
+        return 400, "Usuário atingiu o limite de 3 empréstimos ativos."
+    return None
 
-    active_user_loans = db.query(models.Loan).filter(models.Loan.user_id == loan.user_id, models.Loan.return_date == None).count()
-    if active_user_loans >= 3:
-        logger.error(f"Usuário id={loan.user_id} atingiu o limite de 3 empréstimos ativos")
-        raise HTTPException(status_code=400, detail="Usuário atingiu o limite de 3 empréstimos ativos.")
-
-    db_loan = models.Loan(user_id=loan.user_id, book_id=loan.book_id)
+def _create_loan(db: Session, loan: schemas.LoanCreate):
+    begin_immediate(db)
+    refused = _take_copy_and_slot(db, loan.user_id, loan.book_id)
+    if refused:
+        db.rollback()
+        status_code, detail = refused
+        logger.error("Empréstimo recusado para user_id=%s, book_id=%s: %s", loan.user_id, loan.book_id, detail)
+        raise HTTPException(status_code=status_code, detail=detail)
+    db_loan = models.Loan(user_id=loan.user_id, book_id=loan.book_id, return_date=None)
     db.add(db_loan)
+    db.flush()
+    stats.record_checkout(db, db_loan)
+    # Fora da Session, a instância não é expirada pelo commit: dispensa o SELECT do refresh
+    db.expunge(db_loan)
     db.commit()
-    db.refresh(db_loan)
-    logger.info(f"Empréstimo criado com id={db_loan.id} para user_id={loan.user_id}, book_id={loan.book_id}")
     return db_loan
 
-def get_loans(db: Session, skip: int = 0, limit: int = 100):
-    logger.info(f"Listando empréstimos: skip={skip}, limit={limit}")
-    return db.query(models.Loan).order_by(models.Loan.loan_date.desc()).offset(skip).limit(limit).all()
+def create_loan(db: Session, loan: schemas.LoanCreate):
+    logger.info("Tentando criar empréstimo: user_id=%s, book_id=%s", loan.user_id, loan.book_id)
+    db_loan = retry_on_busy(db, lambda: _create_loan(db, loan))
+    cache.invalidate(("user", loan.user_id), ("book", loan.book_id))
+    _publish_availability(db, loan.book_id)
+    logger.info("Empréstimo criado com id=%s para user_id=%s, book_id=%s", db_loan.id, loan.user_id, loan.book_id)
+    return db_loan
+
+def _loan_query(db: Session, eager: bool = False, model=models.Loan):
+    # model é models.Loan (camada quente) ou models.LoanHistory (empréstimos arquivados)
+    query = db.query(model)
+    if eager:
+        # Carrega usuário e livro no mesmo SELECT para evitar N+1 ao acessar loan.user / loan.book
+        query = query.options(joinedload(model.user), joinedload(model.book))
+    return query
+
+def _loan_rows(db: Session, query, expand: bool, model=models.Loan):
+    # Caminho rápido de _loan_query: dicts no formato de schemas.LoanDetail. Com expand, nome do
+    # usuário e título do livro vêm do mesmo SELECT (LEFT JOIN, como o joinedload)
+    statement = query.with_entities(*(getattr(model, name) for name in schemas.Loan.model_fields)).statement
+    if expand:
+        statement = (
+            statement.outerjoin(models.User, models.User.id == model.user_id)
+            .outerjoin(models.Book, models.Book.id == model.book_id)
+            .add_columns(
+                models.User.id.label("expand_user_id"), models.User.name.label("expand_user_name"),
+                models.Book.id.label("expand_book_id"), models.Book.title.label("expand_book_title"),
+            )
+        )
+    rows = serialization.as_dicts(db.execute(statement))
+    if expand:
+        for row in rows:
+            user_id, user_name = row.pop("expand_user_id"), row.pop("expand_user_name")
+            book_id, book_title = row.pop("expand_book_id"), row.pop("expand_book_title")
+            row["user"] = {"id": user_id, "name": user_name} if user_id is not None else None
+            row["book"] = {"id": book_id, "title": book_title} if book_id is not None else None
+    return rows
+
+def _loan_results(db: Session, query, eager: bool, as_rows: bool, model=models.Loan):
+    return _loan_rows(db, query, eager, model) if as_rows else query.all()
+
+def get_loans(db: Session, skip: int = 0, limit: int = 100, eager: bool = False, after: Optional[Tuple[date, int]] = None, as_rows: bool = False):
+    read_logger.info("Listando empréstimos: skip=%s, limit=%s, eager=%s, after=%s", skip, limit, eager, after)
+    query = _loan_query(db, eager and not as_rows)
+    if after is not None:
+        # (loan_date, id) é único, então a página seguinte não repete nem pula linhas
+        query = query.filter(tuple_(models.Loan.loan_date, models.Loan.id) < after)
+    query = query.order_by(models.Loan.loan_date.desc(), models.Loan.id.desc()).offset(skip).limit(limit)
+    return _loan_results(db, query, eager, as_rows)
+
+def get_overdue_loans(db: Session, skip: int = 0, limit: int = 100, eager: bool = False, after: Optional[Tuple[date, int]] = None, as_of: Optional[date] = None, as_rows: bool = False):
+    as_of = as_of or date.today()
+    read_logger.info("Listando empréstimos atrasados em %s: skip=%s, limit=%s, after=%s", as_of, skip, limit, after)
+    # Filtro e ordenação batem com o índice parcial ix_loans_open_due_date
+    query = _loan_query(db, eager and not as_rows).filter(models.Loan.return_date == None, models.Loan.due_date < as_of)
+    if after is not None:
+        query = query.filter(tuple_(models.Loan.due_date, models.Loan.id) > after)
+    query = query.order_by(models.Loan.due_date, models.Loan.id).offset(skip).limit(limit)
+    return _loan_results(db, query, eager, as_rows)
 
-def get_loan(db: Session, loan_id: int):
-    logger.info(f"Buscando empréstimo com id={loan_id}")
-    return db.query(models.Loan).filter(models.Loan.id == loan_id).first()
+def accrue_overdue_fines(db: Session, as_of: Optional[date] = None, chunk_size: int = FINE_JOB_CHUNK_SIZE) -> int:
+    """Atualiza a multa acumulada de todos os empréstimos abertos e atrasados.
+
+    Cada bloco é um único UPDATE sobre o índice parcial, com commit próprio para não segurar
+    o lock de escrita do SQLite por muito tempo; chunk_size=0 faz tudo em um UPDATE só.
+    """
+    as_of = as_of or date.today()
+    Loan = models.Loan
+    fine = cast(func.julianday(literal(as_of)) - func.julianday(Loan.due_date), Integer) * FINE_PER_DAY
+    updated = 0
+    last_key = None
+    while True:
+        conditions = [Loan.return_date == None]
+        if last_key is not None:
+            conditions += [Loan.due_date >= last_key[0], tuple_(Loan.due_date, Loan.id) > last_key]
+        boundary = None
+        if chunk_size:
+            boundary = (
+                db.query(Loan.due_date, Loan.id).filter(*conditions, Loan.due_date < as_of)
+                .order_by(Loan.due_date, Loan.id).offset(chunk_size - 1).first()
+            )
+        if boundary is not None:
+            # O fim do bloco já é um atrasado e substitui due_date < as_of: com os dois extremos
+            # em due_date o SQLite lê só a faixa do bloco no índice, e não até o fim dele
+            conditions += [Loan.due_date <= boundary[0], tuple_(Loan.due_date, Loan.id) <= tuple(boundary)]
+        else:
+            conditions.append(Loan.due_date < as_of)
+        statement = update(Loan).where(*conditions, Loan.fine.is_distinct_from(fine)).values(fine=fine)
+        result = db.execute(statement.execution_options(synchronize_session=False))
+        db.commit()
+        updated += result.rowcount
+        if boundary is None:
+            break
+        last_key = tuple(boundary)
+    if updated:
+        # As entradas de empréstimos em cache guardam a multa antiga
+        cache.clear()
+    logger.info("Multas de empréstimos atrasados atualizadas em %s: %s empréstimos", as_of, updated)
+    return updated
+
+def get_loan(db: Session, loan_id: int, fresh: bool = False):
+    read_logger.info("Buscando empréstimo com id=%s", loan_id)
+    query = db.query(models.Loan).filter(models.Loan.id == loan_id)
+    # Empréstimos arquivados continuam acessíveis pelo id; só quem não está em loans paga a segunda consulta
+    load = lambda: query.first() or archive.get_archived_loan(db, loan_id)
+    if fresh:
+        return load()
+    return cache.read_through(("loan", loan_id), load, models.Loan, version=versions.table_version(db, "loans"))
 
 def update_loan(db: Session, loan_id: int, loan: schemas.LoanCreate):
-    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first()
+    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first() or archive.get_archived_loan(db, loan_id)
     if not db_loan:
-        logger.error(f"Empréstimo id={loan_id} não encontrado para atualização")
+        logger.error("Empréstimo id=%s não encontrado para atualização", loan_id)
         raise HTTPException(status_code=404, detail="Empréstimo não encontrado")
     if db_loan.return_date:
         raise HTTPException(status_code=400, detail="Não é possível editar um empréstimo que já foi devolvido.")
+    previous = (db_loan.user_id, db_loan.book_id)
+    if previous != (loan.user_id, loan.book_id):
+        _adjust_active_loans(db, db_loan.user_id, db_loan.book_id, -1)
+        _adjust_active_loans(db, loan.user_id, loan.book_id, 1)
     db_loan.user_id = loan.user_id
     db_loan.book_id = loan.book_id
+    stats.record_reassign(db, previous[0], previous[1], db_loan)
     db.commit()
+    cache.invalidate(
+        ("loan", loan_id), ("user", previous[0]), ("book", previous[1]),
+        ("user", loan.user_id), ("book", loan.book_id),
+    )
+    _publish_availability(db, previous[1], loan.book_id)
     db.refresh(db_loan)
-    logger.info(f"Empréstimo id={loan_id} atualizado")
+    logger.info("Empréstimo id=%s atualizado", loan_id)
     return db_loan
 
 def delete_loan(db: Session, loan_id: int):
-    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first()
+    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first() or archive.get_archived_loan(db, loan_id)
     if not db_loan:
-        logger.error(f"Empréstimo id={loan_id} não encontrado para remoção")
+        logger.error("Empréstimo id=%s não encontrado para remoção", loan_id)
         raise HTTPException(status_code=404, detail="Empréstimo não encontrado")
     if not db_loan.return_date:
         raise HTTPException(status_code=400, detail="Não é possível remover um empréstimo em andamento. Realize a devolução primeiro.")
+    stats.record_delete(db, db_loan)
     db.delete(db_loan)
     db.commit()
-    logger.info(f"Empréstimo id={loan_id} removido")
+    cache.invalidate(("loan", loan_id))
+    logger.info("Empréstimo id=%s removido", loan_id)
     return {"detail": "Empréstimo removido"}
 
 def return_loan(db: Session, loan_id: int):
-    logger.info(f"Tentando registrar devolução do empréstimo id={loan_id}")
+    logger.info("Tentando registrar devolução do empréstimo id=%s", loan_id)
     db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id, models.Loan.return_date == None).first()
     if not db_loan:
-        logger.error(f"Empréstimo id={loan_id} não encontrado ou já devolvido")
+        logger.error("Empréstimo id=%s não encontrado ou já devolvido", loan_id)
         raise HTTPException(status_code=404, detail="Empréstimo não encontrado ou já devolvido.")
 
     db_loan.return_date = date.today()
-    logger.info(f"Empréstimo id={loan_id} devolvido em {db_loan.return_date}")
+    logger.info("Empréstimo id=%s devolvido em %s", loan_id, db_loan.return_date)
 
     if db_loan.return_date > db_loan.due_date:
         overdue_days = (db_loan.return_date - db_loan.due_date).days
-        db_loan.fine = overdue_days * 2.00 # R$ 2,00 por dia de atraso
-        logger.info(f"Empréstimo id={loan_id} está atrasado {overdue_days} dias. Multa aplicada: R${db_loan.fine:.2f}")
+        db_loan.fine = overdue_days * FINE_PER_DAY
+        logger.info("Empréstimo id=%s está atrasado %s dias. Multa aplicada: R$%.2f", loan_id, overdue_days, db_loan.fine)
 
+    _adjust_active_loans(db, db_loan.user_id, db_loan.book_id, -1)
+    stats.record_return(db, db_loan)
     db.commit()
+    cache.invalidate(("loan", loan_id), ("user", db_loan.user_id), ("book", db_loan.book_id))
+    _publish_availability(db, db_loan.book_id)
     db.refresh(db_loan)
     return db_loan
 
 def undo_loan_return(db: Session, loan_id: int):
-    logger.info(f"Tentando desfazer devolução do empréstimo id={loan_id}")
-    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first()
+    logger.info("Tentando desfazer devolução do empréstimo id=%s", loan_id)
+    db_loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first() or archive.get_archived_loan(db, loan_id)
     if not db_loan:
-        logger.error(f"Empréstimo id={loan_id} não encontrado")
+        logger.error("Empréstimo id=%s não encontrado", loan_id)
         raise HTTPException(status_code=404, detail="Empréstimo não encontrado.")
     
     if db_loan.return_date is None:
-        logger.error(f"Empréstimo id={loan_id} não está devolvido.")
+        logger.error("Empréstimo id=%s não está devolvido.", loan_id)
         raise HTTPException(status_code=400, detail="Este empréstimo não está marcado como devolvido.")
 
-    if not check_book_availability(db, db_loan.book_id):
-        logger.error(f"Livro id={db_loan.book_id} não disponível para um novo empréstimo")
+    if not check_book_availability(db, db_loan.book_id, fresh=True):
+        logger.error("Livro id=%s não disponível para um novo empréstimo", db_loan.book_id)
         raise HTTPException(status_code=400, detail="A devolução não pode ser desfeita pois o livro não está mais disponível (todos as cópias foram emprestadas).")
 
+    if isinstance(db_loan, models.LoanHistory):
+        # Volta para a camada quente na mesma transação em que deixa de estar devolvido
+        db_loan = archive.restore_loan(db, db_loan)
+    previous_fine = db_loan.fine
     db_loan.return_date = None
     db_loan.fine = 0.0
+    _adjust_active_loans(db, db_loan.user_id, db_loan.book_id, 1)
+    stats.record_undo_return(db, db_loan, previous_fine)
     db.commit()
+    cache.invalidate(("loan", loan_id), ("user", db_loan.user_id), ("book", db_loan.book_id))
+    _publish_availability(db, db_loan.book_id)
     db.refresh(db_loan)
-    logger.info(f"Devolução do empréstimo id={loan_id} desfeita com sucesso")
+    logger.info("Devolução do empréstimo id=%s desfeita com sucesso", loan_id)
     return db_loan
 
-def get_user_loans(db: Session, user_id: int):
-    logger.info(f"Listando empréstimos do usuário id={user_id}")
-    return db.query(models.Loan).filter(models.Loan.user_id == user_id).all()
\ No newline at end of file
+def _adjust_active_loans_grouped(db: Session, user_deltas: Counter, book_deltas: Counter):
+    # Uma instrução por tabela (executemany), com o delta já somado por usuário e por livro
+    users, books = models.User.__table__, models.Book.__table__
+    db.execute(
+        update(users).where(users.c.id == bindparam("key")).values(active_loans=users.c.active_loans + bindparam("delta")),
+        [{"key": key, "delta": delta} for key, delta in user_deltas.items()],
+    )
+    db.execute(
+        update(books).where(books.c.id == bindparam("key")).values(active_loans=books.c.active_loans + bindparam("delta")),
+        [{"key": key, "delta": delta} for key, delta in book_deltas.items()],
+    )
+
+def _batch_result(items, committed: bool) -> dict:
+    if not committed:
+        for item in items:
+            if item["status"] != "failed":
+                item.update(status="skipped", error="Lote não aplicado: há itens com falha.", loan=None)
+    failed = sum(1 for item in items if item["status"] == "failed")
+    succeeded = sum(1 for item in items if item["status"] in ("created", "returned"))
+    return {"committed": committed, "succeeded": succeeded, "failed": failed, "items": items}
+
+def create_loans_batch(db: Session, batch: schemas.LoanBatchCreate):
+    logger.info("Empréstimo em lote: user_id=%s, book_ids=%s, atomic=%s", batch.user_id, batch.book_ids, batch.atomic)
+    return retry_on_busy(db, lambda: _create_loans_batch(db, batch))
+
+def _create_loans_batch(db: Session, batch: schemas.LoanBatchCreate):
+    # Leituras e escritas sob o mesmo lock de escrita: o que foi verificado não muda até o commit
+    begin_immediate(db)
+    user = get_user(db, batch.user_id, fresh=True)
+    if not user:
+        db.rollback()
+        logger.error("Usuário id=%s não encontrado", batch.user_id)
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+
+    # Disponibilidade de todos os livros do lote em uma consulta; o limite do usuário é checado uma vez
+    books = {
+        book_id: quantity - active_loans
+        for book_id, quantity, active_loans in db.query(models.Book.id, models.Book.quantity, models.Book.active_loans)
+        .filter(models.Book.id.in_(set(batch.book_ids)))
+    }
+    slots = MAX_ACTIVE_LOANS_PER_USER - user.active_loans
+    items, accepted = [], []
+    for book_id in batch.book_ids:
+        item = {"book_id": book_id, "status": "failed"}
+        if book_id not in books:
+            item["error"] = "Livro não encontrado."
+        elif books[book_id] <= 0:
+            item["error"] = "Livro não disponível para empréstimo."
+        elif slots <= 0:
+            item["error"] = "Usuário atingiu o limite de 3 empréstimos ativos."
+        else:
+            books[book_id] -= 1
+            slots -= 1
+            item["status"] = "created"
+            accepted.append(item)
+        items.append(item)
+
+    if not accepted or (batch.atomic and len(accepted) < len(items)):
+        db.rollback()
+        logger.warning("Empréstimo em lote para user_id=%s não aplicado: %s de %s itens com falha", batch.user_id, len(items) - len(accepted), len(items))
+        return _batch_result(items, committed=False)
+
+    loans = [models.Loan(user_id=batch.user_id, book_id=item["book_id"]) for item in accepted]
+    db.add_all(loans)
+    _adjust_active_loans_grouped(db, Counter({batch.user_id: len(loans)}), Counter(loan.book_id for loan in loans))
+    db.flush()
+    stats.record_checkouts(db, loans)
+    # Serializados antes do commit, que expira as instâncias (um SELECT por empréstimo no refresh)
+    for item, loan in zip(accepted, loans):
+        item["loan"] = schemas.Loan.model_validate(loan, from_attributes=True)
+    db.commit()
+    cache.invalidate(("user", batch.user_id), *(("book", loan.book_id) for loan in loans))
+    _publish_availability(db, *(item["book_id"] for item in accepted))
+    logger.info("Empréstimo em lote para user_id=%s: %s criados, %s com falha", batch.user_id, len(loans), len(items) - len(loans))
+    return _batch_result(items, committed=True)
+
+def return_loans_batch(db: Session, batch: schemas.LoanReturnBatch):
+    logger.info("Devolução em lote: loan_ids=%s, atomic=%s", batch.loan_ids, batch.atomic)
+    return retry_on_busy(db, lambda: _return_loans_batch(db, batch))
+
+def _return_loans_batch(db: Session, batch: schemas.LoanReturnBatch):
+    begin_immediate(db)
+    found = {loan.id: loan for loan in db.query(models.Loan).filter(models.Loan.id.in_(set(batch.loan_ids)))}
+    missing = set(batch.loan_ids) - found.keys()
+    archived = set(
+        db.execute(select(models.LoanHistory.id).where(models.LoanHistory.id.in_(missing))).scalars()
+    ) if missing else set()
+    today = date.today()
+    items, returned, seen = [], [], set()
+    for loan_id in batch.loan_ids:
+        item = {"loan_id": loan_id, "status": "failed"}
+        loan = found.get(loan_id)
+        if loan is None and loan_id not in archived:
+            item["error"] = "Empréstimo não encontrado."
+        elif loan is None or loan_id in seen or loan.return_date is not None:
+            item["error"] = "Empréstimo já devolvido."
+        else:
+            item["status"] = "returned"
+            returned.append((item, loan))
+        seen.add(loan_id)
+        items.append(item)
+
+    if not returned or (batch.atomic and len(returned) < len(items)):
+        db.rollback()
+        logger.warning("Devolução em lote não aplicada: %s de %s itens com falha", len(items) - len(returned), len(items))
+        return _batch_result(items, committed=False)
+
+    loans = [loan for _, loan in returned]
+    for loan in loans:
+        loan.return_date = today
+        if today > loan.due_date:
+            loan.fine = (today - loan.due_date).days * FINE_PER_DAY
+    _adjust_active_loans_grouped(
+        db, Counter({user_id: -count for user_id, count in Counter(loan.user_id for loan in loans).items()}),
+        Counter({book_id: -count for book_id, count in Counter(loan.book_id for loan in loans).items()}),
+    )
+    db.flush()
+    stats.record_returns(db, loans)
+    for item, loan in returned:
+        item["loan"] = schemas.Loan.model_validate(loan, from_attributes=True)
+    db.commit()
+    cache.invalidate(*(
+        key for loan in loans for key in (("loan", loan.id), ("user", loan.user_id), ("book", loan.book_id))
+    ))
+    _publish_availability(db, *(item["loan"].book_id for item, _ in returned))
+    logger.info("Devolução em lote: %s devolvidos, %s com falha", len(loans), len(items) - len(loans))
+    return _batch_result(items, committed=True)
+
+def get_user_loans(db: Session, user_id: int, eager: bool = False, as_rows: bool = False):
+    read_logger.info("Listando empréstimos do usuário id=%s, eager=%s", user_id, eager)
+    # Histórico completo: camada quente e empréstimos arquivados, cada um pelo índice (user_id, loan_date)
+    loans = []
+    for model in (models.LoanHistory, models.Loan):
+        query = _loan_query(db, eager and not as_rows, model).filter(model.user_id == user_id).order_by(model.loan_date, model.id)
+        loans.extend(_loan_results(db, query, eager, as_rows, model))
+    key = itemgetter("loan_date", "id") if as_rows else attrgetter("loan_date", "id")
+    return sorted(loans, key=key)
+
+@lru_cache(maxsize=None)
+def _chunk_adapter(schema):
+    return TypeAdapter(List[schema])
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'linha'}: {err['msg']}" for err in exc.errors())
+
+def _validate_chunk(chunk, schema, errors):
+    # Caminho rápido: valida o lote inteiro de uma vez; só cai para linha a linha se houver erro
+    adapter = _chunk_adapter(schema)
+    try:
+        values = adapter.dump_python(adapter.validate_python([row for _, row in chunk]))
+        return [(number, row) for (number, _), row in zip(chunk, values)]
+    except ValidationError:
+        pass
+    valid = []
+    for number, row in chunk:
+        if not isinstance(row, dict):
+            errors.append(schemas.BulkRowError(row=number, error="Linha não é um objeto válido."))
+            continue
+        try:
+            valid.append((number, schema.model_validate(row).model_dump()))
+        except ValidationError as e:
+            errors.append(schemas.BulkRowError(row=number, error=_validation_message(e)))
+    return valid
+
+def _executemany(db: Session, model, sql: str, params: list):
+    connection = db.connection()
+    if model is not models.Book:
+        connection.exec_driver_sql(sql, params)
+        return
+    # O trigger books_fts_ai indexaria uma linha por vez: no lote ele fica suspenso e as linhas
+    # novas (ids acima do maior id antes do lote, com o lock de escrita já tomado) entram no FTS
+    # com um único INSERT ... SELECT, na mesma transação
+    begin_immediate(db)
+    before = connection.exec_driver_sql("SELECT coalesce(max(id), 0) FROM books").scalar()
+    connection.exec_driver_sql("INSERT INTO books_fts_deferred (active) VALUES (1)")
+    connection.exec_driver_sql(sql, params)
+    connection.exec_driver_sql(models.BOOKS_FTS_SYNC_SQL, (before,))
+    connection.exec_driver_sql("DELETE FROM books_fts_deferred")
+
+def _insert_chunk(db: Session, model, valid, errors):
+    # executemany direto no driver, em uma única transação por lote; em caso de conflito, refaz linha a linha
+    if not valid:
+        return 0
+    valid = [(number, models.with_search_keys(model.__tablename__, values)) for number, values in valid]
+    columns = list(valid[0][1])
+    sql = f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    try:
+        _executemany(db, model, sql, [tuple(values[c] for c in columns) for _, values in valid])
+        db.commit()
+        return len(valid)
+    except IntegrityError:
+        db.rollback()
+    created = 0
+    for number, values in valid:
+        try:
+            db.connection().exec_driver_sql(sql, tuple(values[c] for c in columns))
+            db.commit()
+            created += 1
+        except IntegrityError:
+            db.rollback()
+            errors.append(schemas.BulkRowError(row=number, error="Violação de integridade ao inserir a linha."))
+    return created
+
+def _bulk_create(db: Session, rows: Iterable, schema, model, check_chunk=None, chunk_size: int = BULK_CHUNK_SIZE):
+    rows = iter(rows)
+    received = created = 0
+    errors = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        received += len(chunk)
+        valid = _validate_chunk(chunk, schema, errors)
+        if check_chunk:
+            valid = check_chunk(db, valid, errors)
+        created += _insert_chunk(db, model, valid, errors)
+    errors.sort(key=lambda e: e.row)
+    return schemas.BulkResult(received=received, created=created, failed=len(errors), errors=errors)
+
+def _check_unique_emails(db: Session, valid, errors):
+    emails = list({values["email"] for _, values in valid})
+    if not emails:
+        return valid
+    # Uma única consulta por lote para checar emails já cadastrados
+    sql = f"SELECT email FROM users WHERE email IN ({', '.join('?' for _ in emails)})"
+    existing = {row[0] for row in db.connection().exec_driver_sql(sql, tuple(emails))}
+    accepted = []
+    for number, values in valid:
+        if values["email"] in existing:
+            errors.append(schemas.BulkRowError(row=number, error="Email já cadastrado."))
+            continue
+        existing.add(values["email"])
+        accepted.append((number, values))
+    return accepted
+
+def bulk_create_users(db: Session, rows: Iterable, chunk_size: int = BULK_CHUNK_SIZE):
+    logger.info("Carga em lote de usuários: chunk_size=%s", chunk_size)
+    result = _bulk_create(db, rows, schemas.UserCreate, models.User, _check_unique_emails, chunk_size)
+    logger.info("Carga de usuários concluída: recebidos=%s, criados=%s, falhas=%s", result.received, result.created, result.failed)
+    return result
+
+def bulk_create_books(db: Session, rows: Iterable, chunk_size: int = BULK_CHUNK_SIZE):
+    logger.info("Carga em lote de livros: chunk_size=%s", chunk_size)
+    result = _bulk_create(db, rows, schemas.BookCreate, models.Book, chunk_size=chunk_size)
+    logger.info("Carga de livros concluída: recebidos=%s, criados=%s, falhas=%s", result.received, result.created, result.failed)
+    return result
\ No newline at end of file
@@ -0,0 +1,161 @@
+import logging
+from collections import Counter
+from datetime import date, timedelta
+from sqlalchemy import Integer, cast, delete, func, literal, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from . import archive, models
+
+# Estatísticas de circulação mantidas de forma incremental: services.py chama as funções
+# record_* antes do commit de cada operação, então resumo e empréstimos mudam juntos.
+# rebuild() recalcula tudo a partir de loans e loan_history (migração, carga direta no banco,
+# correções). Arquivar um empréstimo não muda nenhum número: ele só troca de tabela.
+
+STATS_TOP_BOOKS = 10
+STATS_DAYS = 30
+
+logger = logging.getLogger(__name__)
+
+def _add_totals(db: Session, **deltas):
+    totals = models.CirculationTotals
+    db.execute(
+        update(totals).where(totals.id == 1)
+        .values({name: getattr(totals, name) + delta for name, delta in deltas.items()})
+    )
+
+def _add_book_loans(db: Session, book_id: int, delta: int):
+    table = models.BookCirculation
+    db.execute(
+        insert(table).values(book_id=book_id, total_loans=delta)
+        .on_conflict_do_update(index_elements=[table.book_id], set_={"total_loans": table.total_loans + delta})
+    )
+
+def _add_daily_checkouts(db: Session, day: date, delta: int):
+    table = models.DailyCheckouts
+    db.execute(
+        insert(table).values(day=day, checkouts=delta)
+        .on_conflict_do_update(index_elements=[table.day], set_={"checkouts": table.checkouts + delta})
+    )
+
+def _track_user(db: Session, user_id: int, delta: int):
+    # Chamado depois de somar delta a users.active_loans: o usuário entra na contagem quando
+    # sai de 0 empréstimos ativos (agora tem exatamente delta) e sai quando volta a 0
+    boundary = delta if delta > 0 else 0
+    crossed = (
+        select(cast(models.User.active_loans == boundary, Integer))
+        .where(models.User.id == user_id).scalar_subquery()
+    )
+    _add_totals(db, users_with_active_loans=crossed * (1 if delta > 0 else -1))
+
+def record_checkout(db: Session, loan: models.Loan):
+    _add_totals(db, total_loans=1, active_loans=1)
+    _track_user(db, loan.user_id, 1)
+    _add_book_loans(db, loan.book_id, 1)
+    _add_daily_checkouts(db, loan.loan_date, 1)
+
+def record_checkouts(db: Session, loans):
+    # Versão em lote de record_checkout: uma instrução por usuário, livro e dia, não por empréstimo
+    _add_totals(db, total_loans=len(loans), active_loans=len(loans))
+    for user_id, count in Counter(loan.user_id for loan in loans).items():
+        _track_user(db, user_id, count)
+    for book_id, count in Counter(loan.book_id for loan in loans).items():
+        _add_book_loans(db, book_id, count)
+    for day, count in Counter(loan.loan_date for loan in loans).items():
+        _add_daily_checkouts(db, day, count)
+
+def record_return(db: Session, loan: models.Loan):
+    _add_totals(db, active_loans=-1, returned_loans=1, total_fines=loan.fine or 0.0)
+    _track_user(db, loan.user_id, -1)
+
+def record_returns(db: Session, loans):
+    _add_totals(
+        db, active_loans=-len(loans), returned_loans=len(loans),
+        total_fines=sum(loan.fine or 0.0 for loan in loans),
+    )
+    for user_id, count in Counter(loan.user_id for loan in loans).items():
+        _track_user(db, user_id, -count)
+
+def record_undo_return(db: Session, loan: models.Loan, previous_fine: float):
+    _add_totals(db, active_loans=1, returned_loans=-1, total_fines=-(previous_fine or 0.0))
+    _track_user(db, loan.user_id, 1)
+
+def record_reassign(db: Session, previous_user_id: int, previous_book_id: int, loan: models.Loan):
+    if previous_user_id != loan.user_id:
+        _track_user(db, previous_user_id, -1)
+        _track_user(db, loan.user_id, 1)
+    if previous_book_id != loan.book_id:
+        _add_book_loans(db, previous_book_id, -1)
+        _add_book_loans(db, loan.book_id, 1)
+
+def record_delete(db: Session, loan: models.Loan):
+    # Só empréstimos já devolvidos podem ser removidos
+    _add_totals(db, total_loans=-1, returned_loans=-1, total_fines=-(loan.fine or 0.0))
+    _add_book_loans(db, loan.book_id, -1)
+    _add_daily_checkouts(db, loan.loan_date, -1)
+
+def rebuild_tables(db):
+    # db pode ser uma Session ou uma Connection (migração); o commit fica com quem chama
+    Loan = archive.all_loans().subquery().c
+    db.execute(delete(models.CirculationTotals))
+    db.execute(delete(models.BookCirculation))
+    db.execute(delete(models.DailyCheckouts))
+    open_loan = Loan.return_date == None
+    totals = select(
+        literal(1),
+        func.count(Loan.id),
+        func.coalesce(func.sum(cast(open_loan, Integer)), 0),
+        func.coalesce(func.sum(cast(Loan.return_date != None, Integer)), 0),
+        select(func.count(func.distinct(Loan.user_id))).where(open_loan).scalar_subquery(),
+        func.coalesce(func.sum(Loan.fine).filter(Loan.return_date != None), 0.0),
+    )
+    db.execute(insert(models.CirculationTotals).from_select(
+        ["id", "total_loans", "active_loans", "returned_loans", "users_with_active_loans", "total_fines"], totals,
+    ))
+    db.execute(insert(models.BookCirculation).from_select(
+        ["book_id", "total_loans"], select(Loan.book_id, func.count(Loan.id)).group_by(Loan.book_id),
+    ))
+    db.execute(insert(models.DailyCheckouts).from_select(
+        ["day", "checkouts"], select(Loan.loan_date, func.count(Loan.id)).group_by(Loan.loan_date),
+    ))
+def rebuild(db: Session):
+    logger.info("Reconstruindo as estatísticas de circulação a partir de loans e loan_history")
+    rebuild_tables(db)
+    db.commit()
+    logger.info("Estatísticas de circulação reconstruídas")
+
+def get_stats(db: Session, top: int = STATS_TOP_BOOKS, days: int = STATS_DAYS, today: date = None) -> dict:
+    today = today or date.today()
+    totals = db.get(models.CirculationTotals, 1)
+    top_books = (
+        db.query(models.Book.id, models.Book.title, models.Book.author, models.BookCirculation.total_loans)
+        .join(models.BookCirculation, models.BookCirculation.book_id == models.Book.id)
+        .filter(models.BookCirculation.total_loans > 0)
+        .order_by(models.BookCirculation.total_loans.desc())
+        .limit(top)
+        .all()
+    )
+    first_day = today - timedelta(days=days - 1)
+    counts = dict(
+        db.query(models.DailyCheckouts.day, models.DailyCheckouts.checkouts)
+        .filter(models.DailyCheckouts.day >= first_day, models.DailyCheckouts.day <= today)
+        .all()
+    )
+    active_users = totals.users_with_active_loans if totals else 0
+    active_loans = totals.active_loans if totals else 0
+    return {
+        "total_loans": totals.total_loans if totals else 0,
+        "active_loans": active_loans,
+        "returned_loans": totals.returned_loans if totals else 0,
+        "users_with_active_loans": active_users,
+        "active_loans_per_user": round(active_loans / active_users, 2) if active_users else 0.0,
+        "total_fines": round(totals.total_fines, 2) if totals else 0.0,
+        "top_books": [
+            {"id": book_id, "title": title, "author": author, "total_loans": total}
+            for book_id, title, author, total in top_books
+        ],
+        # Dias sem empréstimos aparecem com zero, para o gráfico ter uma barra por dia
+        "daily_checkouts": [
+            {"day": first_day + timedelta(days=offset), "checkouts": counts.get(first_day + timedelta(days=offset), 0)}
+            for offset in range(days)
+        ],
+    }
@@ -0,0 +1,104 @@
+import datetime
+import email.utils
+import math
+import time
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import models
+from .database import get_read_db
+
+# ETag/Last-Modified das rotas GET a partir das versões por tabela em table_versions, que
+# triggers incrementam na mesma transação de cada escrita (models.create_table_versions).
+# Como as versões ficam no banco, todos os workers e processos de manutenção veem o mesmo
+# número. Conferir custa uma consulta de uma linha por tabela, na sessão de leitura da rota.
+
+TABLES = ("users", "books", "loans")
+
+def _known(db: Session) -> dict:
+    # Versões já lidas na transação atual da sessão; uma transação nova começa sem nenhuma
+    transaction, known = db.info.get("table_versions", (None, {}))
+    if transaction is not db.get_transaction():
+        known = {}
+        db.info["table_versions"] = (db.get_transaction(), known)
+    return known
+
+def current(db: Session, *tables):
+    rows = dict(
+        (name, (version, modified_at))
+        for name, version, modified_at in db.execute(
+            select(models.TableVersion.name, models.TableVersion.version, models.TableVersion.modified_at)
+            .where(models.TableVersion.name.in_(tables))
+        )
+    )
+    _known(db).update((table, version) for table, (version, _) in rows.items())
+    return [rows[table][0] for table in tables], max(rows[table][1] for table in tables)
+
+def table_version(db: Session, table: str) -> int:
+    """Versão atual da tabela, para o cache de services.py.
+
+    Nas rotas com conditional_get a versão já foi lida na mesma transação e não custa consulta."""
+    known = _known(db)
+    if table not in known:
+        current(db, table)
+        known = _known(db)
+    return known[table]
+
+def etag_for(numbers) -> str:
+    return 'W/"' + "-".join(str(n) for n in numbers) + '"'
+
+def last_modified(modified_at: float, now: float) -> datetime.datetime:
+    # Last-Modified tem resolução de segundos. O valor enviado é o segundo seguinte à última
+    # escrita, ou o segundo atual se ele ainda não terminou; como If-Modified-Since só gera 304
+    # com a escrita estritamente anterior à data recebida, uma escrita no mesmo segundo de uma
+    # leitura nunca fica escondida atrás de um 304.
+    seconds = min(math.floor(modified_at) + 1, math.floor(now))
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Comparação fraca: ignora o prefixo W/
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def conditional_get(*tables, daily: bool = False):
+    """Dependência que responde 304 enquanto as tabelas não mudarem.
+
+    Com daily=True a resposta também depende da data de hoje (ex.: atrasos em /loans/overdue):
+    a data entra no ETag e a virada do dia conta como uma modificação para If-Modified-Since."""
+    def dependency(request: Request, response: Response, db: Session = Depends(get_read_db)):
+        # get_read_db é a mesma sessão da rota (o FastAPI reaproveita a dependência na requisição)
+        numbers, modified_at = current(db, *tables)
+        if daily:
+            # Lida antes da rota: na virada do dia, o pior caso é um 200 a mais no dia seguinte
+            today = datetime.date.today()
+            numbers.append(today.isoformat())
+            modified_at = max(modified_at, datetime.datetime.combine(today, datetime.time.min).timestamp())
+        etag = etag_for(numbers)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": email.utils.format_datetime(last_modified(modified_at, time.time()), usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = _matches(if_none_match, etag)
+        else:
+            not_modified = False
+            if_modified_since = request.headers.get("if-modified-since")
+            if if_modified_since:
+                try:
+                    not_modified = modified_at < email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        if not_modified:
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        request.state.cache_headers = headers
+    return dependency
+
+def with_cache_headers(request: Request, response: Response) -> Response:
+    # Para rotas que devolvem um Response pronto (ex.: TemplateResponse do frontend)
+    response.headers.update(getattr(request.state, "cache_headers", {}))
+    return response
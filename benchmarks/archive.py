@@ -0,0 +1,165 @@
+"""Latência das consultas quentes de empréstimos com um histórico grande, antes e depois do
+arquivamento em loan_history.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.archive --history 10000000 --repeat 200
+
+O conjunto recente (últimos dois anos) vem do datagen; os empréstimos históricos, todos
+devolvidos e mais antigos que isso, são inseridos direto pelo SQLite (CTE recursiva), porque
+--history costuma ser grande. As operações são medidas com todo o histórico em loans, depois
+o arquivamento move para loan_history o que foi devolvido há mais de --older-than-days dias
+(a vazão também é medida) e as operações são medidas de novo no mesmo banco. Por fim, confere
+que um empréstimo novo não reaproveita o id de um arquivado ou removido; sai com código 1 se
+reaproveitar.
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from app import archive, logs, schemas, services
+from app.database import create_db_engine
+
+from . import datagen
+
+HISTORY_INSERT_SQL = """
+WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < :count - 1)
+INSERT INTO loans (user_id, book_id, loan_date, due_date, return_date, fine)
+SELECT 1 + (n * 7919) % :users, 1 + (n * 104729) % :books, day, date(day, '+14 days'), date(day, '+10 days'), 0.0
+FROM (SELECT n, date(:start, '+' || (n * :span / :count) || ' days') AS day FROM seq)
+"""
+
+
+def add_history(engine, count: int, users: int, books: int, today: datetime.date, years: int):
+    # Do fim do período do datagen (730 dias atrás) para trás, em ordem crescente de data
+    end = today - datetime.timedelta(days=731)
+    start = end - datetime.timedelta(days=365 * years)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            HISTORY_INSERT_SQL.replace(":count", str(count)).replace(":users", str(users))
+            .replace(":books", str(books)).replace(":span", str((end - start).days)),
+            {"start": start.isoformat()},
+        )
+
+
+def create_fixtures(Session):
+    # Um leitor e um livro com exemplares de sobra para o ciclo empréstimo + devolução
+    db = Session()
+    try:
+        book_id = services.create_book(db, schemas.BookCreate(title="Exemplar de bancada", author="Bench", quantity=10**6)).id
+        reader_id = services.create_user(db, schemas.UserCreate(name="Leitor de bancada", email="bancada@example.com")).id
+    finally:
+        db.close()
+    return reader_id, book_id
+
+
+def operations(Session, users: int, reader_id: int, book_id: int, rng: random.Random):
+    db = Session()
+
+    def checkout_and_return():
+        loan = services.create_loan(db, schemas.LoanCreate(user_id=reader_id, book_id=book_id))
+        services.return_loan(db, loan.id)
+
+    return db, {
+        "GET /loans/ (1ª página)": lambda: services.get_loans(db, limit=100, as_rows=True),
+        "GET /loans/?expand=true": lambda: services.get_loans(db, limit=100, eager=True, as_rows=True),
+        "GET /loans/overdue": lambda: services.get_overdue_loans(db, limit=100, as_rows=True),
+        "GET /users/{id}/loans": lambda: services.get_user_loans(db, rng.randint(1, users), as_rows=True),
+        "empréstimo + devolução": checkout_and_return,
+    }
+
+
+def check_id_reuse(Session, reader_id: int, book_id: int) -> bool:
+    # Regressão: com todos os devolvidos arquivados, remover o empréstimo mais novo e criar outro
+    # não pode devolver um id que já existe em loan_history (nem o id removido)
+    db = Session()
+    try:
+        archive.archive_returned_loans(db, older_than_days=-1)
+        newest = services.create_loan(db, schemas.LoanCreate(user_id=reader_id, book_id=book_id)).id
+        services.return_loan(db, newest)
+        services.delete_loan(db, newest)
+        created = services.create_loan(db, schemas.LoanCreate(user_id=reader_id, book_id=book_id)).id
+        archived = archive.get_archived_loan(db, created) is not None
+        services.return_loan(db, created)
+    finally:
+        db.close()
+    ok = created > newest and not archived
+    print(f"remover o mais novo e criar outro: id {newest} removido, novo id {created}, "
+          f"{'já existe em loan_history' if archived else 'não existe em loan_history'} -> {'ok' if ok else 'FALHOU'}")
+    return ok
+
+
+def measure(ops: dict, repeat: int) -> dict:
+    results = {}
+    for name, operation in ops.items():
+        for _ in range(min(20, repeat)):
+            operation()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            operation()
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        results[name] = (statistics.median(samples), samples[int(len(samples) * 0.95) - 1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", type=int, default=10_000_000, help="Empréstimos históricos (devolvidos)")
+    parser.add_argument("--history-years", type=int, default=10)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--loans", type=int, default=100000, help="Empréstimos recentes (datagen)")
+    parser.add_argument("--older-than-days", type=int, default=archive.LOAN_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--chunk-size", type=int, default=archive.LOAN_ARCHIVE_CHUNK_SIZE)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logs.configure_logging(level="CRITICAL", use_queue=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'archive.db')}")
+        today = datetime.date.today()
+        start = time.perf_counter()
+        datagen.generate(engine, users=args.users, books=args.books, loans=args.loans, seed=args.seed, today=today)
+        add_history(engine, args.history, args.users, args.books, today, args.history_years)
+        print(f"dados gerados em {time.perf_counter() - start:.0f} s: {args.loans} recentes + {args.history} históricos")
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        reader_id, book_id = create_fixtures(Session)
+
+        db, ops = operations(Session, args.users, reader_id, book_id, random.Random(args.seed))
+        before = measure(ops, args.repeat)
+        db.close()
+
+        db = Session()
+        start = time.perf_counter()
+        moved = archive.archive_returned_loans(db, older_than_days=args.older_than_days, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - start
+        with engine.connect() as conn:
+            hot = conn.exec_driver_sql("SELECT COUNT(*) FROM loans").scalar()
+        print(f"arquivamento: {moved} empréstimos em {elapsed:.1f} s ({moved / elapsed:.0f}/s), {hot} ficaram em loans")
+        db.close()
+
+        db, ops = operations(Session, args.users, reader_id, book_id, random.Random(args.seed))
+        after = measure(ops, args.repeat)
+        db.close()
+        ids_ok = check_id_reuse(Session, reader_id, book_id)
+        engine.dispose()
+
+    print()
+    print(f"{'operação':<26} {'antes p50 ms':>13} {'p95 ms':>8} {'depois p50 ms':>14} {'p95 ms':>8}")
+    for name in before:
+        (old_p50, old_p95), (new_p50, new_p95) = before[name], after[name]
+        print(f"{name:<26} {old_p50 * 1000:>13.2f} {old_p95 * 1000:>8.2f} {new_p50 * 1000:>14.2f} {new_p95 * 1000:>8.2f}")
+    sys.exit(0 if ids_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
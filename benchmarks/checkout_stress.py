@@ -0,0 +1,145 @@
+"""Empréstimos concorrentes em várias threads: verifica que nenhum livro é emprestado além
+das cópias e nenhum usuário passa do limite, e compara a vazão com o fluxo anterior.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.checkout_stress --threads 16 --attempts 4000 --books 300 --copies 3
+
+Cada thread usa a própria Session e tenta empréstimos de pares (usuário, livro) sorteados,
+com poucos livros e poucas cópias para forçar a disputa pela última cópia. O modo "anterior"
+reproduz o create_loan antigo (lê usuário e livro, confere as regras e só então grava, sem
+lock), que é sujeito a corrida. Sai com código 1 se o modo atual violar alguma regra.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+
+from app import logs, models, schemas, services, stats
+from app.database import create_db_engine
+
+from . import datagen
+
+
+def legacy_create_loan(db, loan: schemas.LoanCreate):
+    # Fluxo de create_loan antes da reserva condicional: verificação e gravação separadas
+    user = db.query(models.User).filter(models.User.id == loan.user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    book = db.query(models.Book).filter(models.Book.id == loan.book_id).first()
+    if not book or book.quantity <= book.active_loans:
+        raise HTTPException(status_code=400, detail="Livro não disponível para empréstimo.")
+    if user.active_loans >= services.MAX_ACTIVE_LOANS_PER_USER:
+        raise HTTPException(status_code=400, detail="Usuário atingiu o limite de 3 empréstimos ativos.")
+    db_loan = models.Loan(user_id=loan.user_id, book_id=loan.book_id)
+    db.add(db_loan)
+    services._adjust_active_loans(db, loan.user_id, loan.book_id, 1)
+    db.flush()
+    stats.record_checkout(db, db_loan)
+    db.commit()
+    db.refresh(db_loan)
+    return db_loan
+
+
+MODES = {"anterior": legacy_create_loan, "atual": services.create_loan}
+
+
+def violations(engine) -> dict:
+    with engine.connect() as conn:
+        over_lent = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM books WHERE quantity < "
+            "(SELECT COUNT(*) FROM loans WHERE loans.book_id = books.id AND return_date IS NULL)"
+        ).scalar()
+        over_limit = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM (SELECT user_id FROM loans WHERE return_date IS NULL "
+            f"GROUP BY user_id HAVING COUNT(*) > {services.MAX_ACTIVE_LOANS_PER_USER})"
+        ).scalar()
+        drifted = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM books WHERE active_loans != "
+            "(SELECT COUNT(*) FROM loans WHERE loans.book_id = books.id AND return_date IS NULL)"
+        ).scalar()
+    return {"livros além das cópias": over_lent, "usuários além do limite": over_limit, "contadores divergentes": drifted}
+
+
+def run_mode(name: str, args, path: str):
+    engine = create_db_engine(f"sqlite:///{path}", pool_size=args.threads, max_overflow=0)
+    datagen.generate(engine, args.users, args.books, loans=0, copies=args.copies)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    create = MODES[name]
+    outcomes = {"criados": 0, "recusados": 0, "erros": 0}
+    lock = threading.Lock()
+    remaining = [args.attempts]
+    start_barrier = threading.Barrier(args.threads)
+
+    def worker(worker_seed: int):
+        rng = random.Random(worker_seed)
+        db = Session()
+        start_barrier.wait()
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                loan = schemas.LoanCreate(user_id=rng.randint(1, args.users), book_id=rng.randint(1, args.books))
+                try:
+                    create(db, loan)
+                    outcome = "criados"
+                except HTTPException:
+                    db.rollback()
+                    outcome = "recusados"
+                except Exception:
+                    db.rollback()
+                    outcome = "erros"
+                with lock:
+                    outcomes[outcome] += 1
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    found = violations(engine)
+    engine.dispose()
+    return elapsed, outcomes, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--attempts", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=300)
+    parser.add_argument("--copies", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=["ambos", *MODES], default="ambos")
+    args = parser.parse_args()
+
+    logs.configure_logging(level="CRITICAL", use_queue=False)
+    failed = False
+    modes = list(MODES) if args.mode == "ambos" else [args.mode]
+    print(f"{'modo':<10} {'tentativas/s':>13} {'criados':>8} {'recusados':>10} {'erros':>6}  violações")
+    for name in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            elapsed, outcomes, found = run_mode(name, args, os.path.join(tmp, "stress.db"))
+        broken = {key: value for key, value in found.items() if value}
+        print(
+            f"{name:<10} {args.attempts / elapsed:>13.1f} {outcomes['criados']:>8} {outcomes['recusados']:>10} "
+            f"{outcomes['erros']:>6}  {', '.join(f'{key}: {value}' for key, value in broken.items()) or 'nenhuma'}"
+        )
+        if name == "atual" and (broken or outcomes["erros"]):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Gera um conjunto de dados sintético e reprodutível (mesma semente, mesmos dados).
+
+Uso (na raiz do repositório):
+    python -m benchmarks.datagen --database library.db --users 100000 --books 200000 --loans 1000000
+
+Os empréstimos abertos respeitam as regras de negócio (no máximo 3 por usuário e
+nunca mais que a quantidade de exemplares do livro), e os contadores active_loans e
+as estatísticas de circulação são recalculados no final, então o banco gerado pode
+ser usado pela API.
+"""
+import argparse
+import datetime
+import random
+import time
+
+from sqlalchemy.orm import Session
+
+from app import maintenance, migrations, models, stats
+from app.database import create_db_engine
+from app.services import FINE_PER_DAY, MAX_ACTIVE_LOANS_PER_USER
+
+INSERT_BATCH_SIZE = 10000
+LOAN_DAYS = 14
+# Fração dos empréstimos gerados que ainda estão em aberto (limitada pelas regras acima)
+OPEN_LOAN_RATIO = 0.05
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Diego", "Elisa", "Fábio", "Gabriela", "Heitor", "Íris", "João",
+               "Larissa", "Marcos", "Natália", "Otávio", "Paula", "Rafael", "Sofia", "Tiago", "Vitória", "Yuri"]
+LAST_NAMES = ["Almeida", "Barbosa", "Cardoso", "Dias", "Esteves", "Ferreira", "Gomes", "Henriques",
+              "Lima", "Moura", "Nunes", "Oliveira", "Pereira", "Queiroz", "Ribeiro", "Souza", "Teixeira"]
+TITLE_WORDS = ["amor", "guerra", "cidade", "mar", "sombra", "noite", "memória", "jardim", "tempo", "rio",
+               "silêncio", "viagem", "casa", "história", "segredo", "estrela", "caminho", "sertão", "vento", "livro"]
+
+
+def _batches(rows, size: int = INSERT_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _users(rng: random.Random, count: int):
+    for i in range(1, count + 1):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        yield (name, f"usuario{i}@example.com")
+
+
+def _books(rng: random.Random, count: int, copies: int = None):
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(1, count // 20))]
+    for _ in range(count):
+        words = rng.sample(TITLE_WORDS, rng.randint(1, 4))
+        title = " ".join(words).capitalize()
+        quantity = rng.randint(1, 5)
+        yield (title, rng.choice(authors), copies or quantity)
+
+
+def _loans(rng: random.Random, count: int, users: int, quantities: list, today: datetime.date):
+    # A escolha de quem fica com empréstimo aberto depende só do rng, então é reprodutível
+    open_by_user = {}
+    open_by_book = {}
+    for _ in range(count):
+        user_id = rng.randint(1, users)
+        book_id = rng.randint(1, len(quantities))
+        loan_date = today - datetime.timedelta(days=rng.randint(0, 730))
+        due_date = loan_date + datetime.timedelta(days=LOAN_DAYS)
+        can_stay_open = (
+            open_by_user.get(user_id, 0) < MAX_ACTIVE_LOANS_PER_USER
+            and open_by_book.get(book_id, 0) < quantities[book_id - 1]
+        )
+        if can_stay_open and rng.random() < OPEN_LOAN_RATIO:
+            open_by_user[user_id] = open_by_user.get(user_id, 0) + 1
+            open_by_book[book_id] = open_by_book.get(book_id, 0) + 1
+            yield (user_id, book_id, loan_date.isoformat(), due_date.isoformat(), None, 0.0)
+            continue
+        return_date = min(today, loan_date + datetime.timedelta(days=rng.randint(0, LOAN_DAYS * 2)))
+        fine = max(0, (return_date - due_date).days) * FINE_PER_DAY
+        yield (user_id, book_id, loan_date.isoformat(), due_date.isoformat(), return_date.isoformat(), fine)
+
+
+def generate(engine, users: int, books: int, loans: int, seed: int = 42, today: datetime.date = None, copies: int = None):
+    """Insere users, books e loans em lotes (executemany) e recalcula os contadores.
+
+    copies fixa a quantidade de exemplares de todos os livros (padrão: de 1 a 5, sorteada)."""
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("SELECT EXISTS (SELECT 1 FROM users)").scalar():
+            raise ValueError("O banco já tem dados; use um arquivo novo para gerar o conjunto sintético.")
+    quantities = []
+    with engine.begin() as conn:
+        for batch in _batches(_users(rng, users)):
+            conn.exec_driver_sql(
+                "INSERT INTO users (name, email, name_key, email_key, active_loans) VALUES (?, ?, ?, ?, 0)",
+                [(name, email, models.search_key(name), models.search_key(email)) for name, email in batch],
+            )
+        for batch in _batches(_books(rng, books, copies)):
+            quantities.extend(row[2] for row in batch)
+            conn.exec_driver_sql(
+                "INSERT INTO books (title, author, quantity, title_key, active_loans) VALUES (?, ?, ?, ?, 0)",
+                [(*row, models.search_key(row[0])) for row in batch],
+            )
+        if users and books:
+            for batch in _batches(_loans(rng, loans, users, quantities, today)):
+                conn.exec_driver_sql(
+                    "INSERT INTO loans (user_id, book_id, loan_date, due_date, return_date, fine) VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+    with Session(engine) as db:
+        maintenance.rebuild_active_loan_counters(db)
+        stats.rebuild(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="library.db", help="Arquivo SQLite (deve estar vazio ou não existir)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--copies", type=int, default=None, help="Exemplares de cada livro (padrão: de 1 a 5)")
+    args = parser.parse_args()
+
+    engine = create_db_engine(f"sqlite:///{args.database}")
+    start = time.perf_counter()
+    try:
+        generate(engine, args.users, args.books, args.loans, seed=args.seed, copies=args.copies)
+    except ValueError as exc:
+        raise SystemExit(str(exc))
+    finally:
+        engine.dispose()
+    print(f"{args.users} usuários, {args.books} livros e {args.loans} empréstimos gerados em {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
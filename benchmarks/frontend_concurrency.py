@@ -0,0 +1,105 @@
+"""Mede a vazão das páginas do frontend com N clientes concorrentes.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.frontend_concurrency --loans 20000 --requests 200
+
+Os dados ficam em um SQLite temporário, ligado ao app via dependency_overrides.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import get_db, get_read_db
+from app.run_frontend import app
+
+from . import datagen
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else float("nan")
+
+
+async def run_level(client, path: str, concurrency: int, total: int):
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(path)
+
+    async def worker():
+        while not queue.empty():
+            url = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.get(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, statistics.median(latencies), max(latencies)
+
+
+async def probe_loop_lag(stop: asyncio.Event):
+    # Atraso do event loop: quanto um sleep de 1 ms demora a mais enquanto as listagens rodam
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+    return lags
+
+
+async def main_async(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'clientes':>8} {'req/s':>9} {'p50 ms':>8} {'máx ms':>8} {'lag p95 ms':>11}")
+        for concurrency in args.levels:
+            stop = asyncio.Event()
+            probe = asyncio.create_task(probe_loop_lag(stop))
+            throughput, p50, worst = await run_level(client, args.path, concurrency, args.requests)
+            stop.set()
+            lags = await probe
+            print(f"{concurrency:>8} {throughput:>9.1f} {p50 * 1000:>8.1f} {worst * 1000:>8.1f} {_percentile(lags, 95) * 1000:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--loans", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--path", default="/loans")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+        datagen.generate(engine, args.users, args.books, args.loans)
+        SessionBench = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        def get_bench_db():
+            db = SessionBench()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = get_bench_db
+        app.dependency_overrides[get_read_db] = get_bench_db
+        try:
+            asyncio.run(main_async(args))
+        finally:
+            app.dependency_overrides.clear()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
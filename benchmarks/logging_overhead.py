@@ -0,0 +1,87 @@
+"""Mede o custo do logging por chamada de serviço em cada configuração de logs.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.logging_overhead --calls 20000
+
+Chama services.get_book (servido pelo cache, então o custo é quase só o do logging)
+com a saída de logs redirecionada para um arquivo temporário. A linha "síncrono" é a
+configuração anterior (logging.basicConfig escrevendo direto no stream). Com
+--write-delay-us, cada escrita espera esse tempo, simulando um stderr lento
+(pipe cheio, coletor de logs atrasado).
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import logs, services
+
+from . import datagen, report
+
+MODES = [
+    ("sem logs (WARNING)", dict(level="WARNING", use_queue=False)),
+    ("síncrono", dict(use_queue=False)),
+    ("fila", dict(use_queue=True)),
+    ("fila + json", dict(use_queue=True, fmt="json")),
+    ("fila + amostragem 10%", dict(use_queue=True, sample="app.services.reads=0.1")),
+]
+
+
+class SlowStream:
+    def __init__(self, stream, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_mode(db, book_id: int, calls: int, stream, options):
+    logs.configure_logging(stream=stream, **{"level": "INFO", "fmt": "text", "sample": "", **options})
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        call_start = time.perf_counter()
+        services.get_book(db, book_id)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    # O tempo para esvaziar a fila fica fora da medição: é o que sai do caminho da requisição
+    logs.shutdown()
+    return elapsed / calls, statistics.median(latencies), report.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--write-delay-us", type=float, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+        datagen.generate(engine, users=0, books=1, loans=0, copies=3)
+        db = sessionmaker(bind=engine)()
+        book_id = 1
+        services.get_book(db, book_id)
+
+        print(f"{'modo':<24} {'µs/chamada':>11} {'p50 µs':>8} {'p99 µs':>8}")
+        with open(os.path.join(tmp, "bench.log"), "w", encoding="utf-8") as log_file:
+            stream = SlowStream(log_file, args.write_delay_us / 1e6) if args.write_delay_us else log_file
+            for name, options in MODES:
+                mean, p50, p99 = run_mode(db, book_id, args.calls, stream, options)
+                print(f"{name:<24} {mean * 1e6:>11.1f} {p50 * 1e6:>8.1f} {p99 * 1e6:>8.1f}")
+        db.close()
+        engine.dispose()
+        logging.getLogger().handlers.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Mede o tempo de renderização das listagens do frontend por número de linhas.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.render --rows 10,100,1000,5000 --repeat 20
+
+Renderiza users.html, books.html e loans.html com linhas sintéticas (instâncias fora
+de Session, sem banco) em três modos: tudo de uma vez com o cache de fragmentos vazio
+(o custo de uma página nunca vista), de uma vez com o cache já preenchido, e em
+streaming (Template.generate), em que também é medido o tempo até o primeiro pedaço.
+Antes, compara o carregamento dos templates em um processo novo com e sem o cache de
+bytecode.
+"""
+import argparse
+import datetime
+import statistics
+import tempfile
+import time
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app import models, rendering
+
+TEMPLATES = ["base.html", "_pagination.html", "index.html", "users.html", "books.html", "loans.html",
+             "_user_row.html", "_book_row.html", "_loan_row.html", "user_form.html", "book_form.html", "loan_form.html"]
+
+
+def make_rows(kind: str, count: int):
+    today = datetime.date(2024, 1, 1)
+    rows = []
+    for i in range(1, count + 1):
+        user = models.User(id=i, name=f"Usuário {i}", email=f"usuario{i}@example.com", active_loans=i % 3)
+        book = models.Book(id=i, title=f"Livro número {i}", author=f"Autor {i % 50}", quantity=3, active_loans=i % 3)
+        if kind == "users":
+            rows.append(user)
+        elif kind == "books":
+            rows.append(book)
+        else:
+            returned = today + datetime.timedelta(days=10) if i % 2 else None
+            rows.append(models.Loan(
+                id=i, user_id=i, book_id=i, user=user, book=book, loan_date=today,
+                due_date=today + datetime.timedelta(days=14), return_date=returned, fine=float(i % 4),
+            ))
+    return rows
+
+
+def compile_time(bytecode_dir):
+    # Um Environment novo equivale a um processo novo: nada compilado em memória
+    cache = FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None
+    env = Environment(loader=FileSystemLoader(rendering.TEMPLATES_DIR), autoescape=True, bytecode_cache=cache)
+    start = time.perf_counter()
+    for name in TEMPLATES:
+        env.get_template(name)
+    return time.perf_counter() - start
+
+
+def render_modes(templates, kind: str, rows, repeat: int):
+    template = templates.get_template(f"{kind}.html")
+    context = {"request": None, kind: rows, "success": None, "error": None, "after": None, "next_cursor": None, "page_url": f"/{kind}"}
+    cold, warm, first, streamed = [], [], [], []
+    for _ in range(repeat):
+        rendering.fragments.clear()
+        start = time.perf_counter()
+        template.render(context)
+        cold.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        template.render(context)
+        warm.append(time.perf_counter() - start)
+
+        rendering.fragments.clear()
+        start = time.perf_counter()
+        chunks = rendering._chunks(template, context)
+        next(chunks)
+        first.append(time.perf_counter() - start)
+        for _ in chunks:
+            pass
+        streamed.append(time.perf_counter() - start)
+    return [statistics.median(values) for values in (cold, warm, first, streamed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10,100,1000,5000", help="Números de linhas, separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        without_cache = statistics.median(compile_time(None) for _ in range(5))
+        compile_time(tmp)
+        with_cache = statistics.median(compile_time(tmp) for _ in range(5))
+    print(f"carga dos {len(TEMPLATES)} templates: sem bytecode {without_cache * 1000:.1f} ms, com bytecode {with_cache * 1000:.1f} ms")
+    print()
+
+    templates = rendering.create_templates()
+    print(f"{'página':<8} {'linhas':>7} {'frio ms':>9} {'quente ms':>10} {'1º pedaço ms':>13} {'stream ms':>10} {'µs/linha':>9}")
+    for kind in ("users", "books", "loans"):
+        for count in (int(value) for value in args.rows.split(",")):
+            rows = make_rows(kind, count)
+            cold, warm, first, streamed = render_modes(templates, kind, rows, args.repeat)
+            print(
+                f"{kind:<8} {count:>7} {cold * 1000:>9.2f} {warm * 1000:>10.2f} "
+                f"{first * 1000:>13.2f} {streamed * 1000:>10.2f} {cold / count * 1e6:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Resumo das execuções do benchmarks.runner e comparação com uma execução anterior.
+
+Comparar dois relatórios salvos:
+    python -m benchmarks.report resultado.json --baseline anterior.json --threshold 0.10
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize_route(latencies, statuses, elapsed: float) -> dict:
+    summary = {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+    }
+    for pct in PERCENTILES:
+        value = percentile(latencies, pct)
+        summary[f"p{pct}_ms"] = round(value * 1000, 3) if value is not None else None
+    summary["status"] = {str(code): count for code, count in sorted(statuses.items())}
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(meta: dict, samples: dict, statuses: dict, elapsed: float) -> dict:
+    all_latencies = [value for values in samples.values() for value in values]
+    all_statuses = {}
+    for route_statuses in statuses.values():
+        for code, count in route_statuses.items():
+            all_statuses[code] = all_statuses.get(code, 0) + count
+    return {
+        "meta": {
+            **meta,
+            "elapsed_s": round(elapsed, 3),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+        },
+        "total": summarize_route(all_latencies, all_statuses, elapsed),
+        "routes": {route: summarize_route(samples[route], statuses[route], elapsed) for route in sorted(samples)},
+    }
+
+
+def print_report(report: dict, out=sys.stdout):
+    header = f"{'rota':<30} {'req':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  status"
+    print(header, file=out)
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for route, summary in rows:
+        status = " ".join(f"{code}:{count}" for code, count in summary["status"].items())
+        print(
+            f"{route:<30} {summary['requests']:>7} {summary['throughput_rps']:>9.1f} "
+            f"{summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f}  {status}",
+            file=out,
+        )
+
+
+def mismatches(report: dict, baseline: dict):
+    # Comparações só fazem sentido entre execuções do mesmo cenário sobre os mesmos dados
+    keys = ("target", "scenario", "requests", "concurrency", "seed", "dataset")
+    return [key for key in keys if report["meta"].get(key) != baseline["meta"].get(key)]
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.10):
+    """Lista as rotas cujo p95 subiu ou cuja vazão caiu mais que threshold em relação à base."""
+    regressions = []
+    current_routes = dict(report["routes"], TOTAL=report["total"])
+    baseline_routes = dict(baseline["routes"], TOTAL=baseline["total"])
+    for route, summary in current_routes.items():
+        before = baseline_routes.get(route)
+        if not before:
+            continue
+        if before["p95_ms"] and summary["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {before['p95_ms']:.2f} ms -> {summary['p95_ms']:.2f} ms")
+        if before["throughput_rps"] and summary["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{route}: vazão {before['throughput_rps']:.1f} -> {summary['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def print_comparison(report: dict, baseline: dict, threshold: float, out=sys.stdout) -> int:
+    """Imprime as regressões e devolve o código de saída (1 se houver alguma)."""
+    differing = mismatches(report, baseline)
+    if differing:
+        print(f"AVISO: execuções com parâmetros diferentes ({', '.join(differing)})", file=out)
+    regressions = compare(report, baseline, threshold)
+    for line in regressions:
+        print(f"REGRESSÃO {line}", file=out)
+    return 1 if regressions else 0
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save(report: dict, path: str):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("report")
+    parser.add_argument("--baseline", required=True)
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = load(args.report)
+    print_report(report)
+    sys.exit(print_comparison(report, load(args.baseline), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
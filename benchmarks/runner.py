@@ -0,0 +1,146 @@
+"""Executa um cenário de carga contra a API ou o frontend, em processo, e salva um relatório JSON.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.runner --target api --scenario browse-heavy --requests 5000 --concurrency 16 --output atual.json
+    python -m benchmarks.runner --target api --scenario browse-heavy --output novo.json --baseline atual.json
+
+Sem --database, um SQLite temporário é preenchido pelo benchmarks.datagen com a
+semente informada; com --database, usa um arquivo já gerado (as escritas do
+cenário ficam nele). Os apps são chamados pelo httpx.ASGITransport, sem rede.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.orm import sessionmaker
+
+from app import logs
+from app.database import create_db_engine, get_db, get_read_db
+from app.run_api_only import app as api_app
+from app.run_frontend import app as frontend_app
+
+from . import datagen, report, scenarios
+
+APPS = {"api": api_app, "frontend": frontend_app}
+
+
+async def run_scenario(app, state, scenario: str, total: int, concurrency: int):
+    operations, weights = scenarios.operations_for(scenario, state.target)
+    samples = collections.defaultdict(list)
+    statuses = collections.defaultdict(collections.Counter)
+    remaining = total
+
+    async def worker(client):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            operation = state.rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            label, response = await operation(client, state)
+            samples[label].append(time.perf_counter() - start)
+            statuses[label][response.status_code] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, statuses, elapsed
+
+
+def _dataset_sizes(engine):
+    with engine.connect() as conn:
+        users = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM users").scalar()
+        books = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM books").scalar()
+        loans = conn.exec_driver_sql("SELECT COUNT(*) FROM loans").scalar()
+        open_loans = [row[0] for row in conn.exec_driver_sql("SELECT id FROM loans WHERE return_date IS NULL")]
+    return users, books, loans, open_loans
+
+
+def run(args, path: str):
+    engine = create_db_engine(f"sqlite:///{path}")
+    read_engine = create_db_engine(f"sqlite:///{path}", read_only=True)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        datagen.generate(engine, args.users, args.books, args.loans, seed=args.seed)
+    users, books, loans, open_loans = _dataset_sizes(engine)
+    if not users or not books:
+        raise SystemExit("O banco não tem usuários ou livros; gere os dados com benchmarks.datagen.")
+
+    SessionBench = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    ReadSessionBench = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+    def get_bench_db():
+        db = SessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_bench_read_db():
+        db = ReadSessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = APPS[args.target]
+    app.dependency_overrides[get_db] = get_bench_db
+    app.dependency_overrides[get_read_db] = get_bench_read_db
+    state = scenarios.ScenarioState(args.target, users, books, open_loans, args.seed)
+    try:
+        samples, statuses, elapsed = asyncio.run(run_scenario(app, state, args.scenario, args.requests, args.concurrency))
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+        read_engine.dispose()
+
+    meta = {
+        "target": args.target,
+        "scenario": args.scenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "dataset": {"users": users, "books": books, "loans": loans},
+    }
+    return report.build_report(meta, samples, statuses, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=sorted(APPS), default="api")
+    parser.add_argument("--scenario", choices=sorted(scenarios.SCENARIOS), default="browse-heavy")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--database", help="Arquivo SQLite já gerado; sem ele, usa um banco temporário")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Caminho do relatório JSON")
+    parser.add_argument("--baseline", help="Relatório anterior para comparação")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Variação tolerada antes de acusar regressão")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logs.configure_logging(level=args.log_level)
+    if args.database:
+        result = run(args, args.database)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = run(args, os.path.join(tmp, "bench.db"))
+    logs.shutdown()
+
+    report.print_report(result)
+    if args.output:
+        report.save(result, args.output)
+    if args.baseline:
+        sys.exit(report.print_comparison(result, report.load(args.baseline), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
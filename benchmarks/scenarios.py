@@ -0,0 +1,97 @@
+"""Misturas de requisições usadas pelo benchmarks.runner.
+
+Cada operação recebe o client httpx e o estado compartilhado da execução e devolve
+(rótulo da rota, resposta). O rótulo usa o caminho com parâmetros ({id}), para que
+as latências sejam agrupadas por rota e não por URL.
+"""
+import random
+
+SEARCH_TERMS = ["amor", "guerra", "cidade", "mar", "noite", "memória", "tempo", "sert", "vent", "hist"]
+
+
+class ScenarioState:
+    def __init__(self, target: str, users: int, books: int, open_loans: list, seed: int):
+        self.target = target
+        self.users = users
+        self.books = books
+        # Empréstimos abertos conhecidos: alimentam as devoluções e recebem os novos empréstimos
+        self.open_loans = open_loans
+        self.rng = random.Random(seed)
+
+    def user_id(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def book_id(self) -> int:
+        return self.rng.randint(1, self.books)
+
+
+async def list_books(client, state):
+    if state.target == "frontend":
+        return "GET /books", await client.get("/books")
+    return "GET /books/", await client.get("/books/", params={"limit": 100})
+
+
+async def list_loans(client, state):
+    if state.target == "frontend":
+        return "GET /loans", await client.get("/loans")
+    return "GET /loans/", await client.get("/loans/", params={"limit": 100, "expand": "true"})
+
+
+async def get_book(client, state):
+    book_id = state.book_id()
+    if state.target == "frontend":
+        return "GET /books/{id}/edit", await client.get(f"/books/{book_id}/edit")
+    return "GET /books/{id}", await client.get(f"/books/{book_id}")
+
+
+async def book_availability(client, state):
+    return "GET /books/{id}/availability", await client.get(f"/books/{state.book_id()}/availability")
+
+
+async def search_books(client, state):
+    return "GET /books/search", await client.get("/books/search", params={"q": state.rng.choice(SEARCH_TERMS)})
+
+
+async def user_loans(client, state):
+    return "GET /users/{id}/loans", await client.get(f"/users/{state.user_id()}/loans", params={"expand": "true"})
+
+
+async def checkout(client, state):
+    user_id, book_id = state.user_id(), state.book_id()
+    if state.target == "frontend":
+        # O frontend responde 303 (redirect) também quando o empréstimo é recusado
+        response = await client.post("/loans/new", data={"user_id": user_id, "book_id": book_id})
+        return "POST /loans/new", response
+    response = await client.post("/loans/", json={"user_id": user_id, "book_id": book_id})
+    if response.status_code == 200:
+        state.open_loans.append(response.json()["id"])
+    return "POST /loans/", response
+
+
+async def return_loan(client, state):
+    if not state.open_loans:
+        return await checkout(client, state)
+    loan_id = state.open_loans.pop(state.rng.randrange(len(state.open_loans)))
+    label = "POST /loans/{id}/return"
+    return label, await client.post(f"/loans/{loan_id}/return")
+
+
+# Peso relativo de cada operação por cenário; operações só da API são ignoradas no frontend
+SCENARIOS = {
+    "browse-heavy": [
+        (30, get_book), (20, list_books), (15, search_books), (15, book_availability),
+        (10, list_loans), (10, user_loans), (2, checkout), (2, return_loan),
+    ],
+    "checkout-storm": [(80, checkout), (10, book_availability), (10, get_book)],
+    "return-storm": [(80, return_loan), (10, list_loans), (10, user_loans)],
+}
+
+API_ONLY = {book_availability, search_books, user_loans}
+
+
+def operations_for(scenario: str, target: str):
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Cenário desconhecido: {scenario}. Use um de: {', '.join(SCENARIOS)}")
+    operations = [(weight, op) for weight, op in SCENARIOS[scenario] if target == "api" or op not in API_ONLY]
+    weights = [weight for weight, _ in operations]
+    return [op for _, op in operations], weights
@@ -0,0 +1,89 @@
+"""Custo por linha das listagens da API: caminho antigo (ORM + resposta validada pelo FastAPI)
+contra o caminho rápido (linhas do Core + TypeAdapter.dump_json).
+
+Uso (na raiz do repositório):
+    python -m benchmarks.serialization --limits 100,1000 --repeat 30
+
+O caminho antigo reproduz o que o FastAPI faz com response_model: valida cada objeto do ORM
+com from_attributes, converte para tipos JSON (dump_python) e serializa com json.dumps. O
+custo por linha é a diferença de tempo entre o maior e o menor limite dividida pela diferença
+de linhas, o que desconta o custo fixo de cada consulta.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import sessionmaker
+
+from app import logs, schemas, serialization, services
+from app.database import create_db_engine
+
+from . import datagen
+
+LISTINGS = [
+    ("GET /users/", schemas.User, lambda db, limit, rows: services.get_users(db, limit=limit, as_rows=rows)),
+    ("GET /books/", schemas.Book, lambda db, limit, rows: services.get_books(db, limit=limit, as_rows=rows)),
+    ("GET /loans/", schemas.Loan, lambda db, limit, rows: services.get_loans(db, limit=limit, as_rows=rows)),
+    ("GET /loans/?expand=true", schemas.LoanDetail, lambda db, limit, rows: services.get_loans(db, limit=limit, eager=True, as_rows=rows)),
+]
+
+
+def before(db, schema, fetch, limit: int) -> bytes:
+    adapter = TypeAdapter(List[schema])
+    rows = fetch(db, limit, False)
+    return json.dumps(adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json")).encode()
+
+
+def after(db, schema, fetch, limit: int) -> bytes:
+    return serialization.json_list(schema, fetch(db, limit, True)).body
+
+
+def timed(function, repeat: int) -> float:
+    function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limits", default="100,1000", help="Tamanhos de página, separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    limits = sorted(int(value) for value in args.limits.split(","))
+
+    logs.configure_logging(level="WARNING", use_queue=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        rows = max(limits)
+        datagen.generate(engine, users=rows, books=rows, loans=rows * 2, seed=args.seed)
+        db = sessionmaker(bind=engine)()
+
+        print(f"{'listagem':<26} {'linhas':>7} {'antes ms':>9} {'depois ms':>10}  {'µs/linha antes':>15} {'µs/linha depois':>16}")
+        for label, schema, fetch in LISTINGS:
+            old_times, new_times = [], []
+            for limit in limits:
+                old_times.append(timed(lambda: before(db, schema, fetch, limit), args.repeat))
+                new_times.append(timed(lambda: after(db, schema, fetch, limit), args.repeat))
+                db.expunge_all()
+            span = limits[-1] - limits[0]
+            per_row_old = (old_times[-1] - old_times[0]) / span * 1e6 if span else old_times[0] / limits[0] * 1e6
+            per_row_new = (new_times[-1] - new_times[0]) / span * 1e6 if span else new_times[0] / limits[0] * 1e6
+            for index, limit in enumerate(limits):
+                extra = f"  {per_row_old:>15.2f} {per_row_new:>16.2f}" if index == len(limits) - 1 else ""
+                print(f"{label:<26} {limit:>7} {old_times[index] * 1000:>9.2f} {new_times[index] * 1000:>10.2f}{extra}")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Fan-out de GET /books/availability/stream com muitos clientes SSE concorrentes em um
+servidor uvicorn local: memória e CPU dos inscritos ociosos, latência de entrega e desconexão
+dos clientes que não acompanham.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.sse_fanout --clients 2000 --operations 200
+
+O servidor roda em um subprocesso (uvicorn, um worker) com um SQLite temporário. Os clientes são
+conexões HTTP/1.1 cruas sobre asyncio, sem biblioteca de SSE; --filtered-fraction deles pede
+--ids-per-client livros sorteados (?ids=...) e o resto acompanha todos. Memória (VmRSS) e CPU
+(utime + stime) do servidor vêm de /proc, sem clientes e com todos conectados e ociosos.
+
+As operações (empréstimo e devolução, alternados, por POST) são feitas uma de cada vez: a
+latência vai do envio do POST até cada cliente interessado receber o evento, então inclui a
+própria requisição e o agendamento do lado dos clientes, que dividem o processo de medição.
+
+A fila limitada é exercitada no próprio processo, com um AvailabilityBroker e --broker-subscribers
+inscritos consumidos por events.stream, dos quais --stalled nunca leem: por TCP local, um cliente
+parado só trava o servidor depois de o kernel acumular alguns MiB na conexão, dezenas de milhares
+de eventos. Cada mudança é publicada de uma thread, como nos serviços; mede-se o tempo até o
+último inscrito recebê-la, e os parados devem ser desconectados depois de --queue-size eventos
+sem atrasar os demais. Sai com código 1 se algum evento esperado não chegar ou se algum inscrito
+parado não for desconectado.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from app import events, logs
+from app.database import create_db_engine
+
+from . import datagen, report
+
+STREAM_PATH = "/books/availability/stream"
+DELIVERY_TIMEOUT = 5.0
+
+
+def process_usage(pid: int):
+    # (VmRSS em MiB, segundos de CPU de usuário + sistema) do processo
+    with open(f"/proc/{pid}/status") as status:
+        rss_kb = next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return rss_kb / 1024, cpu
+
+
+class Probe:
+    """Operação em andamento: qual livro mudou, quando o POST saiu e quantas entregas faltam."""
+
+    def __init__(self):
+        self.book_id = None
+        self.started = 0.0
+        self.pending = 0
+        self.done = asyncio.Event()
+        self.latencies = []
+
+
+def request_line(book_ids) -> bytes:
+    query = f"?ids={','.join(map(str, book_ids))}" if book_ids else ""
+    return f"GET {STREAM_PATH}{query} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode()
+
+
+class Client:
+    def __init__(self, port: int, book_ids, probe: Probe):
+        self.port = port
+        self.book_ids = book_ids
+        self.probe = probe
+        self.ready = asyncio.Event()
+        self.received = 0
+        self.overflowed = False
+        self.closed = False
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self.writer.write(request_line(self.book_ids))
+        await self.writer.drain()
+
+    async def run(self):
+        # Lê só as linhas event:/data:; as linhas de tamanho do chunked encoding são ignoradas
+        event = None
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                if line.startswith(b"retry:"):
+                    self.ready.set()
+                elif line.startswith(b"event: "):
+                    event = line[7:].strip()
+                elif line.startswith(b"data: "):
+                    if event == b"overflow":
+                        self.overflowed = True
+                    elif event == b"availability":
+                        self.received += 1
+                        self._deliver(json.loads(line[6:]))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.closed = True
+            self.ready.set()
+
+    def _deliver(self, change: dict):
+        probe = self.probe
+        if change["book_id"] != probe.book_id:
+            return
+        probe.latencies.append(time.perf_counter() - probe.started)
+        probe.pending -= 1
+        if probe.pending == 0:
+            probe.done.set()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def wait_ready(port: int, server: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+        while True:
+            # Se o servidor saiu (porta ocupada, por exemplo), a porta pode ser de outro processo
+            if server.poll() is not None:
+                raise RuntimeError(f"O servidor terminou com código {server.returncode}")
+            try:
+                (await http.get("/books/", params={"limit": 1})).raise_for_status()
+                return
+            except httpx.TransportError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def open_clients(clients, batch: int = 200):
+    # Em lotes, para não passar do backlog do socket de escuta
+    tasks = []
+    for index in range(0, len(clients), batch):
+        group = clients[index:index + batch]
+        await asyncio.gather(*(client.connect() for client in group))
+        tasks.extend(asyncio.create_task(client.run()) for client in group)
+        await asyncio.gather(*(client.ready.wait() for client in group))
+    return tasks
+
+
+async def run_operations(http, probe: Probe, clients, count: int, books: int, rng: random.Random, wait: bool = True):
+    # Empréstimo e devolução alternados do mesmo livro; o usuário nunca passa de um empréstimo ativo
+    lost = 0
+    loan_id = book_id = None
+    for index in range(count):
+        if index % 2 == 0:
+            book_id = rng.randint(1, books)
+        probe.book_id = book_id
+        probe.pending = sum(
+            1 for client in clients
+            if not client.closed and (client.book_ids is None or book_id in client.book_ids)
+        )
+        probe.done.clear()
+        probe.started = time.perf_counter()
+        if index % 2 == 0:
+            response = await http.post("/loans/", json={"user_id": 1, "book_id": book_id})
+            response.raise_for_status()
+            loan_id = response.json()["id"]
+        else:
+            (await http.post(f"/loans/{loan_id}/return")).raise_for_status()
+        if not wait or probe.pending == 0:
+            continue
+        try:
+            await asyncio.wait_for(probe.done.wait(), DELIVERY_TIMEOUT)
+        except asyncio.TimeoutError:
+            lost += probe.pending
+    return lost
+
+
+async def benchmark(args, port: int, server: subprocess.Popen) -> bool:
+    rng = random.Random(args.seed)
+    pid = server.pid
+    await wait_ready(port, server)
+    probe = Probe()
+    # Uma conexão de aquecimento antes da medida de base: a primeira carrega o que o caminho precisa
+    warmup = Client(port, [1], probe)
+    warmup_task = (await open_clients([warmup]))[0]
+    warmup.close()
+    await warmup_task
+    await asyncio.sleep(0.5)
+    base_rss, _ = process_usage(pid)
+
+    filtered = int(args.clients * args.filtered_fraction)
+    clients = [
+        Client(port, sorted(rng.sample(range(1, args.books + 1), args.ids_per_client)) if index < filtered else None, probe)
+        for index in range(args.clients)
+    ]
+    start = time.perf_counter()
+    tasks = await open_clients(clients)
+    connect_seconds = time.perf_counter() - start
+    await asyncio.sleep(1.0)
+    rss, cpu = process_usage(pid)
+    await asyncio.sleep(args.idle_seconds)
+    _, idle_cpu = process_usage(pid)
+    idle_share = (idle_cpu - cpu) / args.idle_seconds
+
+    print(f"clientes: {args.clients} ({filtered} com {args.ids_per_client} ids, {args.clients - filtered} sem filtro), "
+          f"conectados em {connect_seconds:.1f} s")
+    print(f"memória do servidor: {base_rss:.1f} MiB sem clientes, {rss:.1f} MiB com todos "
+          f"({(rss - base_rss) * 1024 / args.clients:.1f} KiB por inscrito)")
+    print(f"CPU do servidor com os inscritos ociosos: {idle_share * 100:.2f}% em {args.idle_seconds:.0f} s")
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+        start = time.perf_counter()
+        lost = await run_operations(http, probe, clients, args.operations, args.books, rng)
+        elapsed = time.perf_counter() - start
+        latencies = [value * 1000 for value in probe.latencies]
+        print(f"operações: {args.operations} em {elapsed:.1f} s, {len(latencies)} entregas, {lost} perdidas")
+        if latencies:
+            print(f"latência de entrega: p50 {statistics.median(latencies):.1f} ms, "
+                  f"p95 {report.percentile(latencies, 95):.1f} ms, máx {max(latencies):.1f} ms")
+
+    for client in clients:
+        client.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return lost == 0
+
+
+async def broker_phase(args) -> bool:
+    # Inscritos em memória com a mesma proporção de filtros; a publicação sai de uma thread
+    rng = random.Random(args.seed)
+    broker = events.AvailabilityBroker(queue_size=args.queue_size)
+    loop = asyncio.get_running_loop()
+    filtered = int(args.broker_subscribers * args.filtered_fraction)
+    pending = {}
+    arrived = asyncio.Event()
+
+    async def consume(subscriber):
+        async for message in events.stream(subscriber, [], broker, keepalive=3600):
+            if message.startswith("event: availability"):
+                book_id = json.loads(message.split("data: ", 1)[1])["book_id"]
+                pending[book_id] -= 1
+                if pending[book_id] == 0:
+                    arrived.set()
+
+    subscribers = [
+        broker.subscribe(rng.sample(range(1, args.books + 1), args.ids_per_client) if index < filtered else None)
+        for index in range(args.broker_subscribers)
+    ]
+    stalled = [broker.subscribe() for _ in range(args.stalled)]
+    consumers = [asyncio.create_task(consume(subscriber)) for subscriber in subscribers]
+    await asyncio.sleep(0)
+
+    fanout, lost = [], 0
+    for index in range(args.queue_size * 2):
+        book_id = rng.randint(1, args.books)
+        pending[book_id] = sum(
+            1 for subscriber in subscribers if subscriber.book_ids is None or book_id in subscriber.book_ids
+        )
+        arrived.clear()
+        start = time.perf_counter()
+        await loop.run_in_executor(None, broker.publish, [{"book_id": book_id, "available": True, "available_copies": index}])
+        try:
+            await asyncio.wait_for(arrived.wait(), DELIVERY_TIMEOUT)
+        except asyncio.TimeoutError:
+            lost += pending[book_id]
+        fanout.append((time.perf_counter() - start) * 1000)
+    disconnected = sum(1 for subscriber in stalled if subscriber.overflowed)
+    state = broker.stats()
+    print(f"broker em processo: {args.broker_subscribers} inscritos + {args.stalled} parados, "
+          f"{len(fanout)} publicações, {lost} entregas perdidas")
+    print(f"publicação até o último inscrito: p50 {statistics.median(fanout):.2f} ms, "
+          f"p95 {report.percentile(fanout, 95):.2f} ms, máx {max(fanout):.2f} ms")
+    print(f"inscritos parados desconectados: {disconnected} de {args.stalled} após {args.queue_size} eventos; "
+          f"{state['subscribers']} inscritos ativos no fim")
+    for task in consumers:
+        task.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+    return lost == 0 and disconnected == args.stalled and state["subscribers"] == args.broker_subscribers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--filtered-fraction", type=float, default=0.9)
+    parser.add_argument("--ids-per-client", type=int, default=20)
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    parser.add_argument("--broker-subscribers", type=int, default=10000)
+    parser.add_argument("--stalled", type=int, default=100)
+    parser.add_argument("--queue-size", type=int, default=events.SSE_QUEUE_SIZE, help="SSE_QUEUE_SIZE")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logs.configure_logging(level="CRITICAL", use_queue=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'sse.db')}"
+        engine = create_db_engine(url)
+        datagen.generate(engine, users=1, books=args.books, loans=0, seed=args.seed, copies=10**6)
+        engine.dispose()
+        env = {**os.environ, "DATABASE_URL": url, "READ_DATABASE_URL": url, "LOG_LEVEL": "WARNING",
+               "SSE_QUEUE_SIZE": str(args.queue_size), "SSE_KEEPALIVE_SECONDS": "60", "PYTHONPATH": os.getcwd()}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.run_api_only:app", "--port", str(args.port),
+             "--log-level", "warning", "--backlog", "4096"],
+            env=env,
+        )
+        try:
+            ok = asyncio.run(benchmark(args, args.port, server))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    print()
+    ok = asyncio.run(broker_phase(args)) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
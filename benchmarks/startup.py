@@ -0,0 +1,102 @@
+"""Tempo de inicialização das aplicações: da importação até a primeira requisição respondida.
+
+Uso (na raiz do repositório):
+    python -m benchmarks.startup --runs 10 --target-ms 300
+
+Cada execução é um processo Python novo que importa o app, roda o lifespan (logging e
+verificação do schema) e responde uma requisição via httpx + ASGI, medindo as três etapas.
+O banco é criado antes, uma vez, então o lifespan encontra o schema na versão atual, como em
+um worker que reinicia. asyncio e httpx são importados antes do cronômetro: o servidor (uvicorn)
+já os carrega antes de importar o app. A linha "dependências" mede só a importação de
+fastapi e sqlalchemy.orm, o piso que o código da aplicação não consegue baixar. Sai com
+código 1 se a mediana do total passar de --target-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from app import migrations
+from app.database import create_db_engine
+
+TARGETS = {
+    "api": ("app.run_api_only", "/books/"),
+    "frontend": ("app.run_frontend", "/books"),
+}
+
+CHILD = """
+import asyncio, json, sys, time
+import httpx
+start = time.perf_counter()
+import fastapi, sqlalchemy.orm
+deps = time.perf_counter()
+if sys.argv[1] == "-":
+    print(json.dumps({"deps": deps - start}))
+    sys.exit(0)
+import importlib
+app = importlib.import_module(sys.argv[1]).app
+imported = time.perf_counter()
+
+async def serve():
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.get(sys.argv[2])
+            response.raise_for_status()
+        return started, time.perf_counter()
+
+started, served = asyncio.run(serve())
+print(json.dumps({"deps": deps - start, "import": imported - start, "lifespan": started - imported,
+                  "first_request": served - started, "total": served - start}))
+"""
+
+
+def measure(module: str, path: str, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, module, path], env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=["ambos", *TARGETS], default="ambos")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        engine = create_db_engine(url)
+        migrations.upgrade(engine)
+        engine.dispose()
+        env = {**os.environ, "DATABASE_URL": url, "READ_DATABASE_URL": url, "LOG_LEVEL": "WARNING",
+               "TEMPLATE_BYTECODE_CACHE_DIR": tmp, "PYTHONPATH": os.getcwd()}
+
+        deps = statistics.median(measure("-", "", env)["deps"] for _ in range(args.runs))
+        print(f"dependências (fastapi + sqlalchemy.orm): {deps * 1000:.0f} ms")
+        print(f"{'app':<10} {'importação ms':>14} {'lifespan ms':>12} {'1ª requisição ms':>17} {'total ms':>9}")
+        targets = list(TARGETS) if args.target == "ambos" else [args.target]
+        for name in targets:
+            module, path = TARGETS[name]
+            # A primeira execução preenche o cache de bytecode (templates e .pyc) e é descartada
+            measure(module, path, env)
+            runs = [measure(module, path, env) for _ in range(args.runs)]
+            result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            over = result["total"] * 1000 > args.target_ms
+            failed = failed or over
+            print(
+                f"{name:<10} {result['import'] * 1000:>14.0f} {result['lifespan'] * 1000:>12.1f} "
+                f"{result['first_request'] * 1000:>17.1f} {result['total'] * 1000:>9.0f}"
+                f"{'  acima da meta de %.0f ms' % args.target_ms if over else ''}"
+            )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
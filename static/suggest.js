@@ -0,0 +1,100 @@
+// Autocompletar do formulário de empréstimo: cada bloco [data-suggest] tem um campo de texto,
+// um campo oculto com o id escolhido e uma lista com as sugestões devolvidas pelo servidor.
+(function () {
+    const DELAY_MS = 150;
+
+    function label(kind, item) {
+        if (kind === "user") {
+            const note = item.can_borrow ? `${item.active_loans} ativo(s)` : "limite de empréstimos atingido";
+            return [item.name, `${item.email} · ${note}`, item.can_borrow];
+        }
+        return [item.title, `${item.author} · Disponível: ${item.available}`, item.available > 0];
+    }
+
+    function setup(block) {
+        const url = block.dataset.suggest;
+        const kind = block.dataset.suggestKind;
+        const hidden = block.querySelector("input[type=hidden]");
+        const input = block.querySelector("input[type=text]");
+        const list = block.querySelector(".list-group");
+        const help = block.querySelector(".form-text");
+        let timer = null;
+        let controller = null;
+
+        function close() {
+            list.classList.add("d-none");
+            list.replaceChildren();
+        }
+
+        function choose(item) {
+            const [title, detail] = label(kind, item);
+            hidden.value = item.id;
+            input.value = title;
+            input.classList.remove("is-invalid");
+            help.textContent = detail;
+            close();
+        }
+
+        function render(items) {
+            list.replaceChildren();
+            for (const item of items) {
+                const [title, detail, ok] = label(kind, item);
+                const button = document.createElement("button");
+                button.type = "button";
+                button.className = "list-group-item list-group-item-action" + (ok ? "" : " text-muted");
+                const strong = document.createElement("strong");
+                strong.textContent = title;
+                const small = document.createElement("small");
+                small.className = "d-block";
+                small.textContent = detail;
+                button.append(strong, small);
+                button.addEventListener("mousedown", (event) => {
+                    event.preventDefault();
+                    choose(item);
+                });
+                list.append(button);
+            }
+            list.classList.toggle("d-none", items.length === 0);
+        }
+
+        async function load(q) {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            try {
+                const response = await fetch(`${url}?${new URLSearchParams({ q })}`, { signal: controller.signal });
+                if (response.ok) render(await response.json());
+            } catch (error) {
+                if (error.name !== "AbortError") throw error;
+            }
+        }
+
+        input.addEventListener("input", () => {
+            // Texto alterado: a escolha anterior deixa de valer até uma nova sugestão ser escolhida
+            hidden.value = "";
+            help.textContent = "";
+            clearTimeout(timer);
+            const q = input.value.trim();
+            if (!q) {
+                close();
+                return;
+            }
+            timer = setTimeout(() => load(q), DELAY_MS);
+        });
+        input.addEventListener("blur", close);
+    }
+
+    const blocks = document.querySelectorAll("[data-suggest]");
+    blocks.forEach(setup);
+
+    const form = blocks.length ? blocks[0].closest("form") : null;
+    if (form) {
+        form.addEventListener("submit", (event) => {
+            for (const hidden of form.querySelectorAll("[data-suggest] input[type=hidden]")) {
+                if (!hidden.value) {
+                    event.preventDefault();
+                    hidden.parentElement.querySelector("input[type=text]").classList.add("is-invalid");
+                }
+            }
+        });
+    }
+})();